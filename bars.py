@@ -0,0 +1,288 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+import numpy as np
+from functions import MARKET_OPEN
+from cache import CACHE_DIR, ttl_for, is_cacheable
+from scheduler import scheduler, revalidator, request_key, PRIORITY_NORMAL
+from parsers import stream_columns, to_records
+
+BARS_DIR = os.path.join(CACHE_DIR, 'bars')
+
+# Functions that accept outputsize, compact returns the latest 100 bars
+INCREMENTAL = ('TIME_SERIES_DAILY', 'FX_DAILY')
+# A compact pull only bridges this many calendar days, beyond that backfill again
+COMPACT_DAYS = 130
+# Commodities the API serves daily, the others start at monthly
+DAILY_COMMODITIES = ('WTI', 'BRENT', 'NATURAL_GAS')
+
+
+def commodity_interval(function):
+    # Finest interval of a commodity, the one series stored for it
+    return 'daily' if function in DAILY_COMMODITIES else 'monthly'
+
+
+def series_name(params):
+    # eg: TIME_SERIES_DAILY-MSFT, FX_DAILY-EUR-USD
+    values = [str(v) for k, v in request_key(params) if k not in ('function', 'outputsize', 'datatype')]
+    return '-'.join([params['function']] + values)
+
+
+class BarStore:
+
+    def __init__(self, root=BARS_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, name, ext):
+        return os.path.join(self.root, f'{name}.{ext}')
+
+    def load(self, name):
+        # Returns (meta, bars) with the bars memory-mapped read-only, or (None, None)
+        try:
+
+            with open(self._path(name, 'json')) as file:
+                meta = json.load(file)
+
+            return meta, np.load(self._path(name, 'npy'), mmap_mode='r')
+
+        except (OSError, ValueError):
+
+            return None, None
+
+    def save(self, name, meta, bars):
+        # Write then rename, so readers never see a half written file
+        for ext in ('npy', 'json'):
+            tmp = self._path(name, f'{ext}.tmp')
+            with open(tmp, 'wb' if ext == 'npy' else 'w') as file:
+                if ext == 'npy':
+                    np.save(file, bars)
+                else:
+                    json.dump(meta, file)
+            os.replace(tmp, self._path(name, ext))
+
+    def merge(self, name, bars):
+        # Keep what is stored before the new bars start, the overlap is replaced
+        # so a bar still forming during the session gets its latest values
+        _, stored = self.load(name)
+        if stored is None or stored.dtype.names != bars.dtype.names or not len(bars):
+            return bars
+        dtype = [(col, np.promote_types(stored.dtype[col], bars.dtype[col])) for col in bars.dtype.names]
+        return np.concatenate([stored[stored['date'] < bars['date'][0]].astype(dtype), bars.astype(dtype)])
+
+    def update(self, priority=PRIORITY_NORMAL, force=False, **params):
+        # Returns {'Meta Data': ..., 'bars': ...}, or the API notice when nothing is stored yet.
+        # Sessions updating the same series at once share one download and merge.
+        # force downloads new bars even if the stored ones have not expired.
+        name = series_name(params)
+        return scheduler.flights.do(
+            ('bars', name), self._update, priority, name, params, force,
+            on_join=lambda: scheduler.promote(priority, **params)
+        )
+
+    def update_stale(self, priority=PRIORITY_NORMAL, force=False, **params):
+        # Stale-while-revalidate: returns (json_data, revalidation) at once when
+        # bars are stored, and updates them in the background once expired (or
+        # with force). revalidation is that Future, or None.
+        meta, bars = self.load(series_name(params))
+        if meta is None:
+            return self.update(priority, **params), None
+        if meta['expires'] > time.time() and not force:
+            return {'Meta Data': meta, 'bars': bars}, None
+        revalidation = revalidator.submit(
+            ('bars', series_name(params)), lambda: self.update(priority, force=force, **params)
+        )
+        return {'Meta Data': meta, 'bars': bars}, revalidation
+
+    def _update(self, priority, name, params, force=False):
+        params = dict(params) # outputsize is added below
+        meta, bars = self.load(name)
+
+        if meta is not None and meta['expires'] > time.time() and not force:
+            return {'Meta Data': meta, 'bars': bars}
+
+        last = date.fromisoformat(meta['last']) if meta and meta['last'] else None
+        limit = None
+
+        if params['function'] in INCREMENTAL:
+            if last is None or last < date.today() - timedelta(days=COMPACT_DAYS):
+                params['outputsize'] = 'full' # Backfill once
+            else:
+                params['outputsize'] = 'compact'
+        elif params['function'] == 'DIGITAL_CURRENCY_DAILY' and last is not None:
+            # Always served whole, so stop reading once we reach what is stored
+            limit = (date.today() - last).days + 2
+
+        # Streamed straight into arrays, the full JSON is never held in memory
+        json_data = scheduler.fetch(priority, parse=stream_columns, limit=limit, **params)
+
+        if not is_cacheable(json_data):
+            if bars is not None:
+                return {'Meta Data': meta, 'bars': bars} # Keep serving what we have
+            return json_data
+
+        title = json_data['title']
+        new_bars = to_records(json_data['dates'], json_data['columns'])
+
+        with self._lock:
+            if params['function'] in INCREMENTAL or params['function'] == 'DIGITAL_CURRENCY_DAILY':
+                bars = self.merge(name, new_bars)
+            else:
+                bars = new_bars # Commodities only come whole
+
+            meta = {
+                'title': title,
+                'updated': time.time(),
+                'expires': time.time() + ttl_for(params),
+                'last': str(bars['date'][-1]) if len(bars) else None
+            }
+            self.save(name, meta, bars)
+
+        return {'Meta Data': meta, 'bars': bars}
+
+
+# One store per process, the files outlive it
+bar_store = BarStore()
+
+
+# ---- INTRADAY ----
+# Only 1-minute bars are downloaded, the other intervals are resampled from them
+
+INTRADAY_INTERVALS = {'1min': 1, '5min': 5, '15min': 15, '60min': 60}
+INTRADAY_CAPACITY = 5000 # 1-minute bars kept per symbol, about 13 sessions
+INTRADAY_SYMBOLS = 32 # Symbols kept in memory, least recently used dropped first
+INTRADAY_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+# Seconds after which a compact pull (the last 100 bars) could leave a gap
+INTRADAY_COMPACT = 90 * 60
+
+
+class RingBars:
+    # Fixed-size NumPy columns of one symbol's bars, oldest overwritten first,
+    # so memory stays the same however long the session runs
+
+    def __init__(self, capacity=INTRADAY_CAPACITY):
+        self.times = np.zeros(capacity, dtype='datetime64[s]')
+        self.columns = {name: np.zeros(capacity, dtype=np.int64 if name == 'volume' else np.float64) for name in INTRADAY_COLUMNS}
+        self.start = 0
+        self.size = 0
+
+    @property
+    def capacity(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + sum(col.nbytes for col in self.columns.values())
+
+    def _order(self):
+        return (self.start + np.arange(self.size)) % self.capacity
+
+    def last(self):
+        return self.times[(self.start + self.size - 1) % self.capacity] if self.size else None
+
+    def extend(self, times, columns):
+        # times ascending. Bars from the stored last one on replace it (it may
+        # still have been forming) and are appended, older ones are skipped.
+        last = self.last()
+        if last is not None:
+            keep = times >= last
+            times, columns = times[keep], {name: col[keep] for name, col in columns.items()}
+            if len(times) and times[0] == last:
+                self.size -= 1
+        times, columns = times[-self.capacity:], {name: col[-self.capacity:] for name, col in columns.items()}
+
+        idx = (self.start + self.size + np.arange(len(times))) % self.capacity
+        self.times[idx] = times
+        for name in INTRADAY_COLUMNS:
+            self.columns[name][idx] = columns[name]
+
+        overflow = max(self.size + len(times) - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + len(times), self.capacity)
+
+    def resample(self, minutes=1):
+        # (times, columns) copies, oldest first, in bars of minutes labelled by their start.
+        # Bars are counted from the session open, so the first hourly bar is
+        # 09:30 to 10:29 and not a 09:00 bar inside the chart's closed hours.
+        order = self._order()
+        times = self.times[order]
+        columns = {name: col[order] for name, col in self.columns.items()}
+        if minutes == 1 or not len(times):
+            return times, columns
+
+        offset = MARKET_OPEN.hour * 60 + MARKET_OPEN.minute
+        buckets = (times.astype('datetime64[m]').astype(np.int64) - offset) // minutes
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        ends = np.append(starts[1:], len(times)) - 1
+        return (buckets[starts] * minutes + offset).astype('datetime64[m]').astype('datetime64[s]'), {
+            'open': columns['open'][starts],
+            'high': np.maximum.reduceat(columns['high'], starts),
+            'low': np.minimum.reduceat(columns['low'], starts),
+            'close': columns['close'][ends],
+            'volume': np.add.reduceat(columns['volume'], starts)
+        }
+
+
+class IntradayStore:
+    # Process-wide 1-minute bars per symbol, in memory only. Once backfilled,
+    # an update only downloads the last 100 bars.
+
+    def __init__(self, capacity=INTRADAY_CAPACITY, max_symbols=INTRADAY_SYMBOLS):
+        self.capacity = capacity
+        self.max_symbols = max_symbols
+        self._symbols = OrderedDict() # symbol -> (RingBars, meta)
+        self._lock = threading.Lock()
+
+    def bars(self, symbol, minutes=1, priority=PRIORITY_NORMAL):
+        # Returns {'Meta Data': ..., 'dates': ..., 'columns': ...} at the interval, or the API notice
+        meta, ring = self.update(symbol, priority)
+        if ring is None:
+            return meta
+        with self._lock:
+            dates, columns = ring.resample(minutes)
+        return {'Meta Data': meta, 'dates': dates, 'columns': columns}
+
+    def update(self, symbol, priority=PRIORITY_NORMAL):
+        # Returns (meta, ring), or (notice, None) when nothing is stored yet
+        return scheduler.flights.do(('intraday', symbol), self._update, symbol, priority)
+
+    def _update(self, symbol, priority):
+        with self._lock:
+            ring, meta = self._symbols.get(symbol, (None, None))
+        # Regular session only, the charts leave out the closed hours
+        params = {'function': 'TIME_SERIES_INTRADAY', 'symbol': symbol, 'interval': '1min', 'extended_hours': 'false'}
+
+        if meta is not None and meta['expires'] > time.time():
+            return meta, ring
+
+        limit = None
+        if ring is None or time.time() - meta['updated'] > INTRADAY_COMPACT:
+            params['outputsize'] = 'full' # Backfill, but read no more than fits
+            limit = self.capacity
+        else:
+            params['outputsize'] = 'compact'
+
+        json_data = scheduler.fetch(priority, parse=stream_columns, limit=limit, **params)
+
+        if not is_cacheable(json_data):
+            if ring is not None:
+                return meta, ring # Keep serving what we have
+            return json_data, None
+
+        with self._lock:
+            ring = ring or RingBars(self.capacity)
+            ring.extend(json_data['dates'].astype('datetime64[s]'), json_data['columns'])
+            meta = {'title': json_data['title'], 'updated': time.time(), 'expires': time.time() + ttl_for(params)}
+            self._symbols[symbol] = (ring, meta)
+            self._symbols.move_to_end(symbol)
+            while len(self._symbols) > self.max_symbols:
+                self._symbols.popitem(last=False)
+
+        return meta, ring
+
+
+intraday_store = IntradayStore()
@@ -0,0 +1,307 @@
+"""Micro-benchmarks for the data paths behind the dashboard.
+
+Runs offline on synthetic payloads shaped like Alpha Vantage responses:
+
+    python benchmark.py
+"""
+import json
+import os
+import pickle
+import random
+import string
+import tempfile
+import timeit
+import tracemalloc
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from functions import plot_candles_stick_bar, plot_line_chart, downsample_candles, downsample_line, to_binary_json
+from indicators import MovingAverages, TECHNICAL_INDICATORS, compute_indicator, indicator_traces
+from parsers import parse_columns, parse_time_series, stream_columns, to_records, to_compact
+from symbols import SymbolIndex
+from memo import MemoCache, memo_cache, memoize
+from bars import RingBars, INTRADAY_COLUMNS
+
+
+def make_daily_payload(rows=5000, volume=True, key='Time Series (Daily)'):
+    # Same shape as an outputsize=full response, newest bar first
+    series = {}
+    day = date(2024, 9, 13)
+    price = 100.0
+    while len(series) < rows:
+        if day.weekday() < 5:
+            price *= 1 + random.uniform(-0.02, 0.02)
+            bar = {
+                '1. open': f'{price:.4f}',
+                '2. high': f'{price * 1.01:.4f}',
+                '3. low': f'{price * 0.99:.4f}',
+                '4. close': f'{price:.4f}'
+            }
+            if volume:
+                bar['5. volume'] = str(random.randint(10**5, 10**7))
+            series[day.isoformat()] = bar
+        day -= timedelta(days=1)
+    return {'Meta Data': {'1. Information': 'Daily Prices'}, key: series}
+
+
+def make_commodity_payload(rows=2000):
+    day = date(2024, 9, 13)
+    data = [{'date': (day - timedelta(days=i)).isoformat(), 'value': f'{random.uniform(50, 90):.2f}'} for i in range(rows)]
+    return {'name': 'Commodity', 'interval': 'daily', 'data': data}
+
+
+def parse_like_views(json_data, key):
+    # What the pages used to do: transpose a frame of strings, then coerce later
+    if key == 'data':
+        df = pd.DataFrame(json_data['data'])
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        return df
+    df = pd.DataFrame(json_data[key]).T
+    df.columns = [col.split('. ', 1)[1] for col in df.columns]
+    df.index.name = 'date'
+    return df.reset_index().astype({col: float for col in df.columns})
+
+
+class BytesResponse:
+    # Stands in for a streamed requests.Response
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def json(self):
+        return json.loads(self.body)
+
+    def close(self):
+        pass
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def report(name, func, number=20):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f'{name:<55} {seconds * 1e3:9.3f} ms')
+    return seconds
+
+
+def bench_parsers():
+    print('--- JSON to DataFrame ---')
+    payloads = {
+        'TIME_SERIES_DAILY full': (make_daily_payload(), 'Time Series (Daily)'),
+        'FX_DAILY full': (make_daily_payload(volume=False, key='Time Series FX (Daily)'), 'Time Series FX (Daily)'),
+        'DIGITAL_CURRENCY_DAILY': (make_daily_payload(rows=2000, key='Time Series (Digital Currency Daily)'), 'Time Series (Digital Currency Daily)'),
+        'Commodity daily': (make_commodity_payload(), 'data'),
+    }
+    for name, (json_data, key) in payloads.items():
+        before = report(f'{name}: transpose + astype', lambda: parse_like_views(json_data, key))
+        after = report(f'{name}: parsers.parse_time_series', lambda: parse_time_series(json_data))
+        print(f'{"":<55} {before / after:8.1f}x faster')
+
+
+def bench_streaming():
+    print('--- Streaming parse (5000 daily bars) ---')
+    body = json.dumps(make_daily_payload()).encode()
+    paths = {
+        'response.json() + parse_columns': lambda: parse_columns(BytesResponse(body).json()),
+        'stream_columns': lambda: stream_columns(BytesResponse(body)),
+        'stream_columns, limit=100': lambda: stream_columns(BytesResponse(body), limit=100),
+    }
+    for name, func in paths.items():
+        report(name, func, number=5)
+        print(f'{"":<55} {peak_memory(func) / 1e6:8.1f} MB peak')
+
+
+def bench_crypto():
+    print('--- Digital currency series, cached per pair (2000 daily bars) ---')
+    key = 'Time Series (Digital Currency Daily)'
+    json_data = make_daily_payload(rows=2000, key=key)
+    _, dates, columns = parse_columns(json_data)
+    compact = to_compact(to_records(dates, columns))
+    report('raw JSON, DataFrame().T[:100]', lambda: pd.DataFrame(json_data[key]).T[:100])
+
+    def window():
+        start = len(compact['dates']) - 100
+        return pd.DataFrame({
+            'date': compact['dates'][start:].view('datetime64[D]'),
+            **{name: values[start:] for name, values in compact['columns'].items()}
+        })
+
+    report('compact arrays, window then DataFrame', window)
+    # st.cache_data keeps every entry pickled
+    print(f'{"":<55} {len(pickle.dumps(json_data)) / 1e3:8.1f} KB cached as raw JSON')
+    print(f'{"":<55} {len(pickle.dumps(compact)) / 1e3:8.1f} KB cached as compact arrays')
+    # and unpickles it on every hit
+    print(f'{"":<55} {peak_memory(lambda: pickle.loads(pickle.dumps(json_data))) / 1e3:8.1f} KB resident, raw JSON')
+    print(f'{"":<55} {peak_memory(lambda: pickle.loads(pickle.dumps(compact))) / 1e3:8.1f} KB resident, compact arrays')
+
+
+def bench_memo():
+    print('--- Cache hit, per call (2000 daily bars) ---')
+    key = 'Time Series (Digital Currency Daily)'
+    json_data = make_daily_payload(rows=2000, key=key)
+    _, dates, columns = parse_columns(json_data)
+    compact = to_compact(to_records(dates, columns))
+    # What st.cache_data does on a hit: unpickle its stored copy
+    raw_pickle, compact_pickle = pickle.dumps(json_data), pickle.dumps(compact)
+    report('st.cache_data, raw JSON', lambda: pickle.loads(raw_pickle), number=50)
+    report('st.cache_data, compact arrays', lambda: pickle.loads(compact_pickle), number=50)
+
+    @memoize(ttl=60)
+    def fetch(sym_1, sym_2):
+        return compact
+
+    fetch('BTC', 'USD')
+    report('memoize, compact arrays', lambda: fetch('BTC', 'USD'), number=1000)
+    memo_cache.clear()
+
+    # 1000 pairs through a cache with room for 100 of them
+    cache = MemoCache(budget=100 * len(compact_pickle))
+    for i in range(1000):
+        cache.put(i, compact, ttl=60)
+    stats = cache.stats()
+    print(f'{"":<55} {stats["entries"]} kept, {stats["evictions"]} evicted, {stats["bytes"] / 1e6:.1f} MB')
+
+
+def bench_moving_averages():
+    print('--- SMA/EMA on a slider move (5000 bars) ---')
+    close = pd.Series(100 + np.cumsum(np.random.randn(5000)))
+    averages = MovingAverages(close.to_numpy())
+    report('rolling().mean() + ewm().mean()', lambda: (
+        close.rolling(window=10, min_periods=1).mean(),
+        close.ewm(span=10, adjust=False, min_periods=1).mean()
+    ))
+    report('MovingAverages lookup', lambda: (averages.sma(10), averages.ema(10)))
+    report('MovingAverages build, all 20 windows', lambda: MovingAverages(close.to_numpy()), number=5)
+    report('MovingAverages append one bar', lambda: averages.sync(np.append(averages.values[:averages.size], 101.0)), number=5)
+
+
+def bench_indicators():
+    print('--- Technical indicators (5000 bars) ---')
+    close = 100 * np.exp(np.cumsum(np.random.randn(5000) * 0.01))
+    df = pd.DataFrame({
+        'date': pd.date_range('2005-01-03', periods=len(close), freq='B'),
+        'open': close,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': np.random.randint(10**5, 10**7, len(close))
+    })
+    for name, (function, inputs, params, _) in TECHNICAL_INDICATORS.items():
+        columns = [df[col].to_numpy(dtype=np.float64) for col in inputs]
+        report(name, lambda: function(*columns, **params))
+    compute_indicator('RSI', 'benchmark', df)
+    report('RSI, cached', lambda: compute_indicator('RSI', 'benchmark', df))
+
+
+def bench_figures():
+    print('--- Candlestick + volume figure (5000 bars) ---')
+    close = 100 * np.exp(np.cumsum(np.random.randn(5000) * 0.01))
+    df = pd.DataFrame({
+        'date': pd.date_range('2005-01-03', periods=len(close), freq='B'),
+        'open': close,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': np.random.randint(10**5, 10**7, len(close))
+    })
+    averages = MovingAverages(close)
+    df['SMA'] = averages.sma(10)
+    overlays, panels = indicator_traces(['Bollinger Bands', 'RSI'], 'benchmark', df)
+    fig = plot_candles_stick_bar(df, 'Daily Prices', 10, overlays, panels)
+
+    def move_slider():
+        df['SMA'] = averages.sma(5)
+        return plot_candles_stick_bar(df, 'Daily Prices', 5, overlays, panels, fig=fig)
+
+    report('build, base layout cached', lambda: plot_candles_stick_bar(df, 'Daily Prices', 10, overlays, panels))
+    report('reuse, indicator traces updated', move_slider)
+    # What st.plotly_chart spends on every run, plotly picks orjson when it is installed
+    for engine in ('json', 'orjson'):
+        try:
+            pio.json.config.default_engine = engine
+            report(f'to_json, {engine} engine', lambda: pio.to_json(fig, validate=False), number=5)
+        except ValueError:
+            print(f'{engine} is not installed')
+    pio.json.config.default_engine = 'auto'
+    report('to_binary_json, typed arrays', lambda: to_binary_json(fig), number=5)
+    print(f'{"":<55} {len(pio.to_json(fig, validate=False)) / 1e6:8.2f} MB as JSON text')
+    print(f'{"":<55} {len(to_binary_json(fig)) / 1e6:8.2f} MB as typed arrays')
+
+
+def bench_downsampling():
+    print('--- Chart payload, full history vs downsampled (20000 bars) ---')
+    close = 100 * np.exp(np.cumsum(np.random.randn(20000) * 0.01))
+    df = pd.DataFrame({
+        'date': pd.date_range('1950-01-02', periods=len(close), freq='B'),
+        'open': close,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': np.random.randint(10**5, 10**7, len(close))
+    })
+    line = pd.DataFrame({'date': df['date'], 'value': close})
+    charts = {
+        'candles, every bar': lambda: plot_candles_stick_bar(df),
+        'candles, downsample_candles': lambda: plot_candles_stick_bar(downsample_candles(df)[0]),
+        'line, every point': lambda: plot_line_chart(line),
+        'line, downsample_line (LTTB)': lambda: plot_line_chart(downsample_line(line)[0]),
+    }
+    for name, build in charts.items():
+        report(name, lambda: pio.to_json(build(), validate=False), number=3)
+        print(f'{"":<55} {len(pio.to_json(build(), validate=False)) / 1e6:8.2f} MB')
+
+
+def bench_intraday():
+    print('--- Intraday ring buffer (5000 one-minute bars) ---')
+    times = np.datetime64('2024-09-13T09:30') + np.arange(5000) * np.timedelta64(1, 'm')
+    close = 100 * np.exp(np.cumsum(np.random.randn(len(times)) * 0.001))
+    columns = {name: close for name in INTRADAY_COLUMNS}
+    columns['volume'] = np.random.randint(10**3, 10**5, len(times))
+    ring = RingBars()
+    ring.extend(times, columns)
+    frame = pd.DataFrame({'date': times, **columns}).set_index('date')
+    print(f'{"":<55} {ring.nbytes / 1e3:8.1f} KB per symbol')
+    report('append 5 new bars', lambda: ring.extend(times[-5:] + np.timedelta64(5, 'm'), {name: values[-5:] for name, values in columns.items()}))
+    report('resample to 15min, pandas', lambda: frame.resample('15min').agg({
+        'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'
+    }).dropna())
+    report('resample to 15min, RingBars.resample', lambda: ring.resample(15))
+
+
+def bench_symbols():
+    print('--- Symbol search, local index (12000 listings) ---')
+    words = [''.join(random.choices(string.ascii_uppercase, k=random.randint(3, 9))) for _ in range(3000)]
+    rows = {}
+    while len(rows) < 12000:
+        symbol = ''.join(random.choices(string.ascii_uppercase, k=random.randint(1, 5)))
+        rows[symbol] = {'1. symbol': symbol, '2. name': ' '.join(random.sample(words, 3)), '3. type': 'Equity'}
+    with tempfile.TemporaryDirectory() as root:
+        index = SymbolIndex(os.path.join(root, 'symbols.json'))
+        report('build from the listing', lambda: index.add(rows.values(), listed=True), number=1)
+        symbol, name = next(iter(rows)), rows[next(iter(rows))]['2. name']
+        report(f'exact symbol ({symbol})', lambda: index.search(symbol), number=1000)
+        report(f'symbol prefix ({symbol[:2]})', lambda: index.search(symbol[:2]), number=1000)
+        report(f'name prefix ({name[:4]})', lambda: index.search(name[:4]), number=1000)
+        report('one typo (QZXQ)', lambda: index.search('QZXQ'), number=1000)
+
+
+if __name__ == '__main__':
+    bench_parsers()
+    bench_streaming()
+    bench_crypto()
+    bench_memo()
+    bench_moving_averages()
+    bench_indicators()
+    bench_figures()
+    bench_downsampling()
+    bench_intraday()
+    bench_symbols()
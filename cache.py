@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functions import next_market_close, is_market_open
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+CACHE_PATH = os.path.join(CACHE_DIR, 'alphavantage.sqlite3')
+MAX_BYTES = 256 * 1024 * 1024 # Least recently used responses are evicted above this
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+def ttl_for(params):
+    # Seconds a response stays fresh, based on how often the endpoint changes
+    function = params.get('function')
+    now = datetime.now(timezone.utc)
+
+    if function in ('GLOBAL_QUOTE', 'CURRENCY_EXCHANGE_RATE'):
+        return MINUTE
+    if function == 'MARKET_STATUS':
+        return 5 * MINUTE
+    if function == 'TIME_SERIES_INTRADAY':
+        # One bar of the interval while trading, nothing new comes in otherwise
+        return int(params.get('interval', '60min').replace('min', '')) * MINUTE if is_market_open(now) else HOUR
+    if function in ('TIME_SERIES_DAILY', 'FX_DAILY'):
+        # A new daily bar only appears once the session closes
+        return (next_market_close(now) - now).total_seconds()
+    if function == 'DIGITAL_CURRENCY_DAILY':
+        # Crypto bars close at midnight UTC
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        return (midnight - now).total_seconds()
+    if function in ('OVERVIEW', 'ETF_PROFILE'):
+        return DAY
+    if function in ('SPLITS', 'SYMBOL_SEARCH', 'LISTING_STATUS'):
+        return WEEK
+    if params.get('interval') in ('monthly', 'quarterly', 'annual'):
+        return WEEK # Commodity monthly and slower series
+    if params.get('interval') in ('daily', 'weekly'):
+        return DAY
+    return HOUR
+
+
+def is_cacheable(json_data):
+    # Rate limit notices and errors must never be served from the cache
+    return not any(key in json_data for key in ('Information', 'Note', 'Error Message'))
+
+
+class ResponseCache:
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body TEXT, size INTEGER, '
+            'stored REAL, expires REAL, accessed REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body FROM responses WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        return json.loads(row[0])
+
+    def get_entry(self, key):
+        # (json_data, stored, expires) even once expired, for stale-while-revalidate.
+        # Only a fresh entry counts as a hit.
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, stored, expires FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None or row[2] <= now:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if row is None:
+                return None
+
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, key, json_data, ttl):
+        now = time.time()
+        body = json.dumps(json_data, separators=(',', ':'))
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, len(body), now, now + ttl, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop the least recently used rows until we are back under 90% of the budget
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        target = total - int(self.max_bytes * 0.9)
+        keys = []
+        for key, size in rows:
+            if target <= 0:
+                break
+            keys.append((key,))
+            target -= size
+
+        self._db.executemany('DELETE FROM responses WHERE key = ?', keys)
+        self.evictions += len(keys)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size
+        }
+
+
+# Shared by every session in this process, and by the next process after a restart
+response_cache = ResponseCache()
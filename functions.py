@@ -1,8 +1,49 @@
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
 from plotly.subplots import make_subplots
+from indicators import series_version
+import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-def request_alphavantage(**kwargs):
+ALPHAVANTAGE_URL = 'https://www.alphavantage.co/query'
+
+UNREACHABLE = 'Alpha Vantage could not be reached. Please try again later.'
+
+# (connect, read) timeouts in seconds for every call to Alpha Vantage
+TIMEOUT = (3.05, 20)
+
+def _build_session():
+    # One pooled, keep-alive session shared by every page and every session,
+    # so repeated fetches reuse the TCP+TLS connection to alphavantage.co
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5, # Waits 0.5s, 1s, 2s between attempts
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    return session
+
+session = _build_session()
+
+def request_alphavantage(timeout=TIMEOUT, stream=False, **kwargs):
     params = {
         'function': 'TIME_SERIES_INTRADAY', # The time series of your choice.
         'apikey': 'XXX' # Your API key
@@ -12,162 +53,681 @@ def request_alphavantage(**kwargs):
 
     try:
 
-        response = requests.get('https://www.alphavantage.co/query', params=params)
+        response = session.get(ALPHAVANTAGE_URL, params=params, timeout=timeout, stream=stream)
+        response.raise_for_status()
 
         return response
 
-    except:
+    except requests.RequestException:
 
         return None
 
-def plot_candles_stick_bar(df, title="", time_span=None):
+def request_json(**kwargs):
+    response = request_alphavantage(**kwargs)
+
+    if response is None:
+        # Same shape as Alpha Vantage's own notices, so pages surface it the same way
+        return {'Information': UNREACHABLE}
+
+    try:
+
+        return response.json()
+
+    except ValueError:
+
+        return {'Information': 'Alpha Vantage returned an invalid response. Please try again later.'}
+
+# US equity session, holidays are not taken into account
+NEW_YORK = ZoneInfo('America/New_York')
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+
+def is_market_open(now=None):
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+def next_market_close(now=None):
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    close = datetime.combine(now.date(), MARKET_CLOSE, tzinfo=NEW_YORK)
+    if now >= close:
+        close += timedelta(days=1)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+    return close
+
+def format_age(updated, refreshing=False, now=None):
+    # "as of" badge for data that may be shown while a newer copy is on its way
+    now = now or datetime.now().timestamp()
+    age = max(now - updated, 0)
+    if age < 60:
+        ago = 'just now'
+    elif age < 3600:
+        ago = f'{int(age // 60)} min ago'
+    elif age < 86400:
+        ago = f'{int(age // 3600)} h ago'
+    else:
+        ago = f'{int(age // 86400)} days ago'
+    badge = f'as of {datetime.fromtimestamp(updated).strftime("%Y-%m-%d %H:%M")} ({ago})'
+    return f'{badge}, refreshing...' if refreshing else badge
+
+_fetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='fetch')
+# Bulk loads (a whole watchlist) wait in their own small pool, so they never
+# hold every fetch thread while other sessions' pages wait behind them
+bulk_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='bulk')
+
+class ApiNotice(Exception):
+    # Raised by a fetcher that got a notice (rate limit, error) instead of data.
+    # Fetchers run by fetch_concurrently must raise it rather than call
+    # st.warning and st.stop: st.stop does not stop a worker thread.
+
+    def __init__(self, json_data):
+        message = next(
+            (json_data[key] for key in ('Information', 'Note', 'Error Message') if key in json_data),
+            'Alpha Vantage returned no data.'
+        )
+        super().__init__(message)
+        self.json_data = json_data
+
+def fetch_or_stop(func, *args):
+    # Runs a fetcher on the script thread, an ApiNotice is shown and ends the run
+    try:
+        return func(*args)
+    except ApiNotice as notice:
+        st.warning(str(notice))
+        st.stop()
+
+def fetch_concurrently(calls, executor=None):
+    # calls maps a name to (function, *args). Yields (name, result) as each call
+    # finishes, so the page can render a section as soon as its data is in.
+    # An ApiNotice is shown from the script thread, where st.stop ends the run.
+    executor = executor or _fetch_executor
+    ctx = get_script_run_ctx()
+
+    def run(func, args):
+        # The session's context, so the worker can find the page's state
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+
+    futures = {
+        executor.submit(run, call[0], call[1:]): name
+        for name, call in calls.items()
+    }
+
+    for future in as_completed(futures):
+        yield futures[future], fetch_or_stop(future.result)
+
+# ---- DOWNSAMPLING ----
+# Charts never get more points than they have pixels for, however long the history
+
+CHART_WIDTH = 1200 # Pixels a chart spans in the wide layout
+CANDLE_PIXELS = 3 # Narrowest candlestick that still reads as one
+AGGREGATIONS = {'D': 'daily', 'W': 'weekly', 'M': 'monthly', 'Q': 'quarterly', 'Y': 'yearly'}
+
+# Visible range: how far back from the last bar the chart starts
+RANGES = {
+    '3M': pd.DateOffset(months=3),
+    '6M': pd.DateOffset(months=6),
+    '1Y': pd.DateOffset(years=1),
+    '5Y': pd.DateOffset(years=5),
+    'Max': None,
+}
+
+def range_start(dates, period):
+    # Index of the first date within the range, dates being sorted datetime64
+    offset = RANGES[period]
+    if offset is None or not len(dates):
+        return 0
+    return int(np.searchsorted(dates, (pd.Timestamp(dates[-1]) - offset).to_datetime64().astype(dates.dtype)))
+
+def visible_range(df, overlays, panels, period):
+    # Keeps the bars within the range, with the indicators computed before over the whole series
+    start = range_start(df['date'].to_numpy(), period)
+    if not start:
+        return df, overlays, panels
+    return _take(df, overlays, panels, slice(start, None))
+
+def _take(df, overlays, panels, index):
+    # Same rows of the frame and of every indicator array
+    df = df.iloc[index].reset_index(drop=True)
+    overlays = {name: values[index] for name, values in (overlays or {}).items()}
+    panels = {panel: {name: values[index] for name, values in series.items()} for panel, series in (panels or {}).items()}
+    return df, overlays, panels
+
+def tail_bars(df, overlays=None, panels=None, count=None):
+    # The newest bars only, as many as the chart has room for (intraday charts)
+    count = count or CHART_WIDTH // CANDLE_PIXELS
+    return _take(df, overlays, panels, slice(max(len(df) - count, 0), None))
+
+# Weekends and the hours outside the US session, left out of intraday charts
+SESSION_BREAKS = [dict(bounds=['sat', 'mon']), dict(bounds=[16, 9.5], pattern='hour')]
+
+def hide_closed_hours(fig):
+    axes = [name for name in fig.layout.to_plotly_json() if name.startswith('xaxis')] or ['xaxis']
+    fig.update_layout({name: dict(rangebreaks=SESSION_BREAKS) for name in axes})
+    return fig
+
+# Intervals of a value series (commodities), finest first
+INTERVALS = ('daily', 'weekly', 'monthly', 'quarterly', 'annual')
+
+def period_starts(dates, interval):
+    # First day of each date's period, as datetime64[D]
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    if interval == 'daily':
+        return dates
+    if interval == 'weekly':
+        return dates - (dates.astype(np.int64) + 3) % 7 # Weeks start on Monday, the epoch was a Thursday
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    if interval == 'quarterly':
+        return (months - months % 3).astype('datetime64[M]').astype('datetime64[D]')
+    if interval == 'annual':
+        return (months - months % 12).astype('datetime64[M]').astype('datetime64[D]')
+    return months.astype('datetime64[M]').astype('datetime64[D]')
+
+def resample_values(dates, values, interval):
+    # Average of each period, missing values left out, dated at the period's
+    # first day: how the API builds its own monthly and annual series
+    starts = period_starts(dates, interval)
+    if interval == 'daily' or not len(starts):
+        return starts, np.asarray(values, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    first = np.flatnonzero(np.diff(starts, prepend=starts[0] - 1).astype(np.int64))
+    missing = np.isnan(values)
+    sums = np.add.reduceat(np.where(missing, 0, values), first)
+    counts = np.add.reduceat(~missing, first)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return starts[first], np.where(counts > 0, sums / counts, np.nan)
 
-    fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
-                        vertical_spacing=0.01,
-                        subplot_titles=None,
-                        row_heights=[0.7, 0.3])
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of threshold points that keep the
+    # shape of the line. First and last points are always kept, then from each
+    # bucket the point making the largest triangle with the previous pick and
+    # the average of the next bucket.
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
 
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
 
-    fig.add_trace(go.Candlestick(x=df['date'].to_numpy(),
-                                 open=df['open'],
-                                 high=df['high'],
-                                 low=df['low'],
-                                 close=df['close'],
-                                 name="OHVC"),
-                  row=1, col=1)
+    # Average point of every bucket, the last point counting as a bucket of its own
+    starts = np.append(edges[:-1], n - 1)
+    present = ~np.isnan(y)
+    avg_x = np.add.reduceat(x, starts) / np.diff(np.append(starts, n))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_y = np.add.reduceat(np.where(present, y, 0), starts) / np.add.reduceat(present, starts)
+
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    with np.errstate(invalid='ignore'):
+        for i in range(threshold - 2):
+            low, high = edges[i], edges[i + 1]
+            area = np.abs((x[a] - avg_x[i + 1]) * (y[low:high] - y[a]) - (x[a] - x[low:high]) * (avg_y[i + 1] - y[a]))
+            area[np.isnan(area)] = -1 # Missing values are never picked over a real one
+            a = low + int(np.argmax(area))
+            picked[i + 1] = a
+
+    return picked
+
+def downsample_line(df, overlays=None, panels=None, price='value', width=CHART_WIDTH):
+    # At most one point per pixel, picked by LTTB on the price and shared with the indicators
+    if len(df) <= width:
+        return df, overlays or {}, panels or {}
+    dates = df['date'].to_numpy().astype(np.int64)
+    return _take(df, overlays, panels, lttb(dates, df[price].to_numpy(), width))
+
+def _resolution(dates, width):
+    # Finest aggregation that fits the width, with the period code of every bar
+    if len(dates) <= width:
+        return 'D', None
+    for freq in ('W', 'M', 'Q', 'Y'):
+        codes = dates.dt.to_period(freq).array.asi8
+        if np.count_nonzero(np.diff(codes)) + 1 <= width or freq == 'Y':
+            return freq, codes
+
+def downsample_candles(df, overlays=None, panels=None, width=CHART_WIDTH):
+    # Daily bars while they fit, then weekly, monthly... OHLC bars. Returns
+    # (df, overlays, panels, resolution) with every bar dated at its period's first day.
+    overlays = overlays or {}
+    panels = panels or {}
+    freq, codes = _resolution(df['date'], width // CANDLE_PIXELS)
+    if codes is None:
+        return df, overlays, panels, AGGREGATIONS[freq]
+
+    starts = np.flatnonzero(np.diff(codes, prepend=codes[0] - 1))
+    ends = np.append(starts[1:], len(codes)) - 1
+
+    aggregated = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if col == 'date' or col == 'open':
+            aggregated[col] = values[starts]
+        elif col == 'high':
+            aggregated[col] = np.fmax.reduceat(values, starts)
+        elif col == 'low':
+            aggregated[col] = np.fmin.reduceat(values, starts)
+        elif col == 'volume':
+            aggregated[col] = np.add.reduceat(values, starts)
+        else:
+            aggregated[col] = values[ends] # Close, moving averages: value at the end of the period
+
+    overlays = {name: values[ends] for name, values in overlays.items()}
+    panels = {panel: {name: values[ends] for name, values in series.items()} for panel, series in panels.items()}
+    return pd.DataFrame(aggregated), overlays, panels, AGGREGATIONS[freq]
+
+# Technical indicator traces drawn over the price, by trace name
+OVERLAY_STYLES = {
+    'BB upper': dict(color='rgba(128, 128, 128, 0.8)', width=1, dash='dot'),
+    'BB middle': dict(color='rgba(128, 128, 128, 0.8)', width=1),
+    'BB lower': dict(color='rgba(128, 128, 128, 0.8)', width=1, dash='dot'),
+    'VWAP': dict(color='orange', width=2),
+}
+PANEL_HEIGHT = 150 # Pixels added for each indicator panel
+
+# Chart types: rows before the indicator panels, and their relative heights
+CHART_ROWS = {
+    'candles_bar': [0.7, 0.3], # Price and volume
+    'candles': [1],
+    'line': [1],
+}
+
+def _axes(row):
+    # Axis references of a subplot row, so traces need no subplot grid
+    return dict(xaxis='x' if row == 1 else f'x{row}', yaxis='y' if row == 1 else f'y{row}')
+
+def _row_heights(main, panels):
+    # The main rows keep their proportions and share 70% when panels are added
+    if not panels:
+        return main
+    return [h * 0.7 for h in main] + [0.3 / len(panels)] * len(panels)
+
+@lru_cache(maxsize=64)
+def _base_layout(kind, panels):
+    # Layout of an empty chart, built once per chart type and set of indicator
+    # panels: make_subplots and the layout validation are the slow part of a build
+    main = CHART_ROWS[kind]
+    rows = len(main) + len(panels)
+
+    if rows > 1:
+        fig = make_subplots(rows=rows, cols=1, shared_xaxes=True,
+                            vertical_spacing=0.01 if kind == 'candles_bar' else 0.02,
+                            subplot_titles=None,
+                            row_heights=_row_heights(main, panels))
+    else:
+        fig = go.Figure()
+
+    if kind == 'line':
+        fig.update_layout(
+            # Tick spacing left to plotly: a fixed monthly tick crowds long or annual series
+            xaxis=dict(
+                tickformat="%b %Y",  # Format ticks to show Month and Year (e.g., Jan 2023)
+            ),
+            yaxis_title='Price',
+            legend=dict(
+                orientation="h",  # Horizontal legend
+                yanchor="top",  # Aligns the legend vertically to the top
+                y=-0.6,  # Positions the legend below the subplots
+                xanchor="center",  # Aligns the legend horizontally to the center
+                x=0.5  # Centers the legend horizontally
+            ),
+            height=600 + PANEL_HEIGHT * len(panels),
+            # The range slider would sit between the price and the first panel
+            xaxis_rangeslider_visible=not panels
+        )
+    else:
+        fig.update_layout(
+            yaxis_title='Price',
+            legend=dict(
+                orientation="h",  # Horizontal legend
+                yanchor="top",  # Aligns the legend vertically to the top
+                y=-0.3,  # Positions the legend below the subplots
+                xanchor="center",  # Aligns the legend horizontally to the center
+                x=0.5  # Centers the legend horizontally
+            ),
+            showlegend=True,
+            xaxis_rangeslider_visible=False
+        )
+        if panels:
+            fig.update_layout(height=450 + PANEL_HEIGHT * len(panels))
+
+    if kind == 'candles_bar':
+        fig.update_layout(yaxis2_title='Volume')
+
+    for row, panel in enumerate(panels, len(main) + 1):
+        fig.update_yaxes(title_text=panel, row=row, col=1)
+
+    if rows > 1:
+        fig.update_xaxes(title_text='Date', row=rows, col=1)
+    else:
+        fig.update_layout(xaxis_title='Date')
+
+    return fig.layout.to_plotly_json()
+
+def _new_figure(kind, panels, signature):
+    # Already validated once, so the copy skips validation. Later layout
+    # updates are not validated either and must use the full form, eg: title=dict(text=...)
+    fig = go.Figure(layout=_base_layout(kind, tuple(panels)), _validate=False)
+    fig.layout.meta = signature
+    return fig
+
+def _signature(kind, title, df, price, panels):
+    # Same signature: same subplots and same price data, only indicators may differ
+    return [kind, title, '|'.join(panels)] + [str(value) for value in series_version(df, price)]
+
+def _indicator_traces(x, df, time_span, overlays, panels, first_panel_row):
+    # Every trace that depends on the selected indicators, keyed by a stable uid
+    traces = []
 
     if 'SMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['SMA'],
+        traces.append(go.Scatter(x=x,
+                                 y=df['SMA'].to_numpy(),
                                  mode='lines',
                                  line=dict(color='black', width=2),
-                                 name=f'{time_span}SMA'),
-                      row=1, col=1)
+                                 name=f'{time_span}SMA',
+                                 uid='SMA',
+                                 **_axes(1)))
     if 'EMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['EMA'],
+        traces.append(go.Scatter(x=x,
+                                 y=df['EMA'].to_numpy(),
                                  mode='lines',
                                  line=dict(color='blue', width=2),
-                                 name=f'{time_span}EMA'),
-                      row=1, col=1)
+                                 name=f'{time_span}EMA',
+                                 uid='EMA',
+                                 **_axes(1)))
+
+    for name, values in (overlays or {}).items():
+        traces.append(go.Scatter(x=x,
+                                 y=values,
+                                 mode='lines',
+                                 line=OVERLAY_STYLES.get(name, dict(width=1)),
+                                 name=name,
+                                 uid=name,
+                                 **_axes(1)))
+
+    # One subplot per indicator, eg: RSI, or MACD with its signal and histogram
+    for row, (panel, series) in enumerate((panels or {}).items(), first_panel_row):
+        for name, values in series.items():
+            if name == 'Histogram':
+                traces.append(go.Bar(x=x, y=values, name=name, uid=name,
+                                     marker_color='rgba(128, 128, 128, 0.5)', **_axes(row)))
+            else:
+                traces.append(go.Scatter(x=x, y=values, mode='lines', line=dict(width=1),
+                                         name=name, uid=name, **_axes(row)))
+
+    return traces
+
+def _sync_indicator_traces(fig, traces, fixed):
+    # Keeps the fixed (price, volume) traces as they are. Indicator traces
+    # that are still selected only get their data arrays and name replaced,
+    # the others are dropped and new ones appended.
+    wanted = {trace.uid: trace for trace in traces}
+    with fig.batch_update():
+        fig.data = [trace for trace in fig.data if trace.uid in fixed or trace.uid in wanted]
+        existing = {trace.uid for trace in fig.data}
+        for trace in fig.data:
+            if trace.uid in wanted:
+                trace.update(y=wanted[trace.uid].y, name=wanted[trace.uid].name)
+    fig.add_traces([trace for trace in traces if trace.uid not in existing])
+
+def _reusable(fig, signature):
+    return fig is not None and list(fig.layout.meta or []) == signature
+
+def plot_candles_stick_bar(df, title="", time_span=None, overlays=None, panels=None, fig=None):
+    # fig is the figure from the previous run, reused when only the indicators changed
+
+    panels = panels or {}
+    signature = _signature('candles_bar', title, df, 'close', panels)
+    x = df['date'].to_numpy()
+    traces = _indicator_traces(x, df, time_span, overlays, panels, first_panel_row=3)
+
+    if _reusable(fig, signature):
+        _sync_indicator_traces(fig, traces, fixed=('OHVC', 'Volume'))
+        return fig
+
+    fig = _new_figure('candles_bar', panels, signature)
+
+    fig.add_trace(go.Candlestick(x=x,
+                                 open=df['open'].to_numpy(),
+                                 high=df['high'].to_numpy(),
+                                 low=df['low'].to_numpy(),
+                                 close=df['close'].to_numpy(),
+                                 name="OHVC",
+                                 uid='OHVC',
+                                 **_axes(1)))
+
+    fig.add_traces(traces[:len(traces) - sum(map(len, panels.values()))])
 
     if 'volume' in df.columns:
-        fig.add_trace(go.Bar(x=df['date'].to_numpy(),
-                             y=df['volume'],
+        fig.add_trace(go.Bar(x=x,
+                             y=df['volume'].to_numpy(),
                              name='Volume',
-                             marker_color='rgba(0, 0, 255, 0.2)'),
-                      row=2, col=1)
+                             uid='Volume',
+                             marker_color='rgba(0, 0, 255, 0.2)',
+                             **_axes(2)))
 
-    fig.update_layout(
-        title=title,
-        # xaxis_title='Date',
-        yaxis_title='Price',
-        xaxis2_title='Date',
-        yaxis2_title='Volume',
-        legend=dict(
-            orientation="h",  # Horizontal legend
-            yanchor="top",  # Aligns the legend vertically to the top
-            y=-0.3,  # Positions the legend below the subplots
-            xanchor="center",  # Aligns the legend horizontally to the center
-            x=0.5  # Centers the legend horizontally
-        ),
-        showlegend=True,
-        xaxis_rangeslider_visible=False
-    )
+    fig.add_traces(traces[len(traces) - sum(map(len, panels.values())):])
+
+    fig.update_layout(title=dict(text=title))
 
     return fig
 
 
-def plot_candles_stick(df, title="", time_span=None):
+def plot_candles_stick(df, title="", time_span=None, overlays=None, panels=None, fig=None):
 
-    fig = go.Figure()
+    panels = panels or {}
+    signature = _signature('candles', title, df, 'close', panels)
+    x = df['date'].to_numpy()
+    traces = _indicator_traces(x, df, time_span, overlays, panels, first_panel_row=2)
 
+    if _reusable(fig, signature):
+        _sync_indicator_traces(fig, traces, fixed=('OHVC',))
+        return fig
 
-    fig.add_trace(go.Candlestick(x=df['date'].to_numpy(),
-                                 open=df['open'],
-                                 high=df['high'],
-                                 low=df['low'],
-                                 close=df['close'],
-                                 name="OHVC")
-                  )
+    fig = _new_figure('candles', panels, signature)
 
-    if 'SMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['SMA'],
-                                 mode='lines',
-                                 line=dict(color='black', width=2),
-                                 name=f'{time_span}SMA')
-                      )
-    if 'EMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['EMA'],
-                                 mode='lines',
-                                 line=dict(color='blue', width=2),
-                                 name=f'{time_span}EMA')
-                      )
+    fig.add_trace(go.Candlestick(x=x,
+                                 open=df['open'].to_numpy(),
+                                 high=df['high'].to_numpy(),
+                                 low=df['low'].to_numpy(),
+                                 close=df['close'].to_numpy(),
+                                 name="OHVC",
+                                 uid='OHVC',
+                                 **_axes(1)))
 
-    fig.update_layout(
-        title=title,
-        xaxis_title='Date',
-        yaxis_title='Price',
-        legend=dict(
-            orientation="h",  # Horizontal legend
-            yanchor="top",  # Aligns the legend vertically to the top
-            y=-0.3,  # Positions the legend below the subplots
-            xanchor="center",  # Aligns the legend horizontally to the center
-            x=0.5  # Centers the legend horizontally
-        ),
-        showlegend=True,
-        xaxis_rangeslider_visible=False
-    )
+    fig.add_traces(traces)
+
+    fig.update_layout(title=dict(text=title))
 
     return fig
 
 
-def plot_line_chart(df, title="", time_span=None):
-    # Create a candlestick chart using Plotly
-    fig = go.Figure()
+def plot_line_chart(df, title="", time_span=None, overlays=None, panels=None, fig=None):
+
+    panels = panels or {}
+    signature = _signature('line', title, df, 'value', panels)
+    x = df['date'].to_numpy()
+    traces = _indicator_traces(x, df, time_span, overlays, panels, first_panel_row=2)
+
+    if _reusable(fig, signature):
+        _sync_indicator_traces(fig, traces, fixed=('Value',))
+        return fig
 
-    fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                             y=df['value'],
+    fig = _new_figure('line', panels, signature)
+
+    fig.add_trace(go.Scatter(x=x,
+                             y=df['value'].to_numpy(),
                              mode='lines',
                              line=dict(color='green', width=2),
-                             name='Value'))
+                             name='Value',
+                             uid='Value',
+                             **_axes(1)))
 
-    if 'SMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['SMA'],
-                                 mode='lines',
-                                 line=dict(color='black', width=2),
-                                 name=f'{time_span}SMA')
-                      )
-    if 'EMA' in df.columns:
+    fig.add_traces(traces)
+
+    # Update layout to add titles and formatting
+    fig.update_layout(title=dict(text=title))
+
+    return fig
+
+
+def update_last_bar(fig, date, close, open=None, high=None, low=None, volume=None, resolution='daily'):
+    # Live update of a candlestick figure in place: the bar of date's period
+    # takes the quote, or a new bar is added when date starts a new period.
+    # Missing open, high and low default to close.
+    candles = next((trace for trace in fig.data if trace.uid == 'OHVC'), None)
+    if candles is None or candles.x is None or not len(candles.x):
+        return fig
+
+    freq = {name: code for code, name in AGGREGATIONS.items()}[resolution]
+    period = pd.Timestamp(date).to_period(freq)
+    last_period = pd.Timestamp(candles.x[-1]).to_period(freq)
+    if period < last_period:
+        return fig # An older quote than the chart
+
+    x, o, h, l, c = (np.array(values) for values in (candles.x, candles.open, candles.high, candles.low, candles.close))
+    high = max(high or close, close)
+    low = min(low or close, close)
+    if period == last_period:
+        if resolution == 'daily' and open is not None:
+            o[-1] = open
+        h[-1] = max(h[-1], high)
+        l[-1] = min(l[-1], low)
+        c[-1] = close
+    else:
+        x = np.append(x, np.datetime64(period.start_time, 'D').astype(x.dtype))
+        o, h, l, c = np.append(o, open or close), np.append(h, high), np.append(l, low), np.append(c, close)
+
+    with fig.batch_update():
+        # No longer the figure of its data, the next full run builds a new one.
+        # Marked once, the fragment redraws the same figure every few seconds.
+        meta = list(fig.layout.meta or [])
+        if meta[-1:] != ['live']:
+            fig.layout.meta = meta + ['live']
+        candles.update(x=x, open=o, high=h, low=l, close=c)
+        volumes = next((trace for trace in fig.data if trace.uid == 'Volume'), None)
+        # The quote's volume is the day's, so it only fits a daily bar
+        if volumes is not None and volume is not None and resolution == 'daily':
+            y = np.array(volumes.y)
+            y = np.append(y, volume) if len(y) < len(x) else np.concatenate([y[:-1], [volume]])
+            volumes.update(x=x, y=y)
+
+    return fig
+
+def plot_comparison_chart(series, title=""):
+    # series maps a symbol to a frame of 'date' and 'change', the percent
+    # change since the first bar shown. One line per symbol, each downsampled.
+
+    fig = go.Figure()
+
+    for symbol, df in series.items():
+        df, _, _ = downsample_line(df, price='change')
         fig.add_trace(go.Scatter(x=df['date'].to_numpy(),
-                                 y=df['EMA'],
+                                 y=df['change'].to_numpy(),
                                  mode='lines',
-                                 line=dict(color='blue', width=2),
-                                 name=f'{time_span}EMA')
-                      )
+                                 line=dict(width=1.5),
+                                 name=symbol))
+
+    fig.add_hline(y=0, line=dict(color='grey', width=1, dash='dot'))
 
-    # Update layout to add titles and formatting
     fig.update_layout(
         title=title,
-        xaxis=dict(
-            tickmode='linear',
-            dtick="M1",  # Set ticks to show every month
-            tickformat="%b %Y",  # Format ticks to show Month and Year (e.g., Jan 2023)
-        ),
         xaxis_title='Date',
-        yaxis_title='Price',
+        yaxis_title='Change (%)',
+        yaxis_ticksuffix='%',
         legend=dict(
             orientation="h",  # Horizontal legend
             yanchor="top",  # Aligns the legend vertically to the top
-            y=-0.6,  # Positions the legend below the subplots
+            y=-0.2,  # Positions the legend below the chart
             xanchor="center",  # Aligns the legend horizontally to the center
             x=0.5  # Centers the legend horizontally
         ),
-        height=600,
-        xaxis_rangeslider_visible=True  # Remove range slider (optional)
+        height=600
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+def plot_correlation_heatmap(corr, title=""):
+    # corr is a square frame of correlations, eg: DataFrame.corr()
+    z = corr.to_numpy()
+
+    fig = go.Figure(go.Heatmap(z=z,
+                               x=list(corr.columns),
+                               y=list(corr.index),
+                               zmin=-1,
+                               zmax=1,
+                               colorscale='RdBu',
+                               text=np.round(z, 2),
+                               texttemplate='%{text}'))
+
+    fig.update_layout(
+        title=title,
+        yaxis_autorange='reversed', # Same order down as across
+        height=600
+    )
+
+    return fig
+
+
+# ---- CHART OUTPUT ----
+# st.plotly_chart sends every number as JSON text. In binary mode the numeric
+# arrays go as base64 typed arrays ({'dtype', 'bdata'}, read by plotly.js >= 2.28)
+# and the figure is drawn by plotly.js in a component.
+
+PLOTLY_JS = f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'
+ARRAY_KEYS = ('x', 'y', 'open', 'high', 'low', 'close') # Trace attributes holding the data
+BDATA_TYPES = {'float64': 'f8', 'float32': 'f4', 'int32': 'i4', 'int16': 'i2', 'int8': 'i1',
+               'uint32': 'u4', 'uint16': 'u2', 'uint8': 'u1'}
+
+def encode_array(values):
+    # Dates become epoch milliseconds, which date axes read as they are.
+    # plotly.js has no 64-bit integers, so those go as float64.
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[ms]').astype(np.int64)
+    if values.dtype.name not in BDATA_TYPES:
+        values = values.astype(np.float64)
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<'))
+    return {'dtype': BDATA_TYPES[values.dtype.name], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+def to_binary_json(fig):
+    # Same figure as pio.to_json(fig), with the data arrays as typed arrays
+    data = []
+    dates = False
+    for trace in fig.data:
+        trace = trace.to_plotly_json()
+        for key in ARRAY_KEYS:
+            values = trace.get(key)
+            if isinstance(values, np.ndarray) and values.dtype.kind in 'iufM':
+                dates = dates or (key == 'x' and values.dtype.kind == 'M')
+                trace[key] = encode_array(values)
+        data.append(trace)
+
+    layout = fig.layout.to_plotly_json()
+    if dates:
+        # Numbers on an axis with no type would be drawn as numbers
+        for name in [key for key in layout if key.startswith('xaxis')] or ['xaxis']:
+            layout[name] = {**layout.get(name, {}), 'type': 'date'}
+
+    return pio.json.to_json_plotly({'data': data, 'layout': layout})
+
+def show_chart(fig, container=None):
+    # Draws fig with st.plotly_chart, or from typed arrays when the sidebar's
+    # binary mode is on. container is where the chart goes, eg: an st.empty()
+    container = container or st.container()
+    if not st.session_state.get('binary_charts'):
+        container.plotly_chart(fig, use_container_width=True)
+        return
+
+    height = fig.layout.height or 450
+    figure = to_binary_json(fig).replace('</', '<\\/') # A title cannot close the script
+    html = f"""
+        <div id="chart" style="height: {height}px;"></div>
+        <script src="{PLOTLY_JS}"></script>
+        <script>
+            const figure = {figure};
+            Plotly.newPlot('chart', figure.data, figure.layout, {{responsive: true}});
+        </script>
+    """
+    with container:
+        components.html(html, height=height + 10)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from parsers import to_records
+
+# Every currency is fetched against the pivot only, any pair is then the
+# ratio of two legs: n currencies cost n - 1 calls instead of n * (n - 1)
+PIVOT = 'USD'
+OHLC = ('open', 'high', 'low', 'close')
+
+
+def legs_of(*currencies):
+    # Currencies that need a PIVOT -> currency call, in order, each once
+    return [currency for currency in dict.fromkeys(currencies) if currency != PIVOT]
+
+
+def _float(value):
+    # Bid and ask are sometimes '-' or missing
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def cross_rate(base, quote, legs):
+    # Exchange rate base -> quote from legs, which maps a currency to its
+    # PIVOT -> currency 'Realtime Currency Exchange Rate'. Same layout as the
+    # API's answer, plus 'derived': False only for a rate quoted as it is.
+    # Crossing the spread gives the widest bid and ask of the two legs.
+    if base == PIVOT:
+        return {**legs[quote], 'derived': False}
+
+    base_leg = legs[base]
+    quote_leg = legs.get(quote) # None for the pivot itself
+    rate = _float(base_leg['5. Exchange Rate'])
+    bid = _float(base_leg['8. Bid Price'])
+    ask = _float(base_leg['9. Ask Price'])
+    if quote_leg is None:
+        quote_rate = quote_bid = quote_ask = 1.0
+        refreshed = base_leg['6. Last Refreshed']
+    else:
+        quote_rate = _float(quote_leg['5. Exchange Rate'])
+        quote_bid = _float(quote_leg['8. Bid Price'])
+        quote_ask = _float(quote_leg['9. Ask Price'])
+        refreshed = min(base_leg['6. Last Refreshed'], quote_leg['6. Last Refreshed']) # The older leg
+
+    return {
+        '1. From_Currency Code': base,
+        '2. From_Currency Name': base_leg['4. To_Currency Name'],
+        '3. To_Currency Code': quote,
+        '4. To_Currency Name': quote_leg['4. To_Currency Name'] if quote_leg else base_leg['2. From_Currency Name'],
+        '5. Exchange Rate': f'{quote_rate / rate:.10g}',
+        '6. Last Refreshed': refreshed,
+        '7. Time Zone': base_leg['7. Time Zone'],
+        '8. Bid Price': f'{quote_bid / ask:.10g}',
+        '9. Ask Price': f'{quote_ask / bid:.10g}',
+        'derived': True
+    }
+
+
+def cross_bars(base, quote):
+    # Daily base -> quote bars from the PIVOT -> base and PIVOT -> quote bars
+    # (None for the pivot), on the dates both legs have. Open and close are
+    # exact. High and low are exact with one leg; with two they assume the
+    # legs peaked together, an estimate that still spans the open and close.
+    if base is None:
+        return quote
+    if quote is None:
+        dates = base['date']
+        i = j = slice(None)
+    else:
+        dates, i, j = np.intersect1d(base['date'], quote['date'], assume_unique=True, return_indices=True)
+
+    legs = {}
+    for col in OHLC:
+        legs[col] = (
+            np.ones(len(dates)) if quote is None else quote[col][j].astype(np.float64),
+            base[col][i].astype(np.float64)
+        )
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns = {col: quote_values / base_values for col, (quote_values, base_values) in legs.items()}
+        # Both legs at their high, or both at their low
+        together = np.stack([columns['high'], legs['low'][0] / legs['low'][1]])
+        ends = np.stack([columns['open'], columns['close']])
+        high = np.fmax(together.max(axis=0), ends.max(axis=0))
+        low = np.fmin(together.min(axis=0), ends.min(axis=0))
+    columns['high'] = high
+    columns['low'] = low
+    return to_records(dates, columns)
+
+
+def rate_matrix(rates):
+    # rates maps a currency to its PIVOT -> currency rate. Every pair at
+    # once: row base, column quote.
+    currencies = list(rates)
+    values = np.array([1.0 if c == PIVOT else rates[c] for c in currencies], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix = values[None, :] / values[:, None]
+    return pd.DataFrame(matrix, index=pd.Index(currencies, name='Base'), columns=currencies)
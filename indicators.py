@@ -0,0 +1,289 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+WINDOWS = np.arange(1, 21) # Every value of the pages' time-span slider
+MAX_ENGINES = 64 # Series kept with their precomputed averages
+SHORT_APPEND = 32 # Bars below which the EMA is stepped in Python rather than by pandas
+
+
+def _grow(array, capacity):
+    # Same data, more room along the last axis
+    grown = np.empty(array.shape[:-1] + (capacity,), dtype=array.dtype)
+    grown[..., :array.shape[-1]] = array
+    return grown
+
+
+class MovingAverages:
+    # SMA and EMA of one series for every window at once, as 2-D arrays
+    # (window x bar). Moving the slider is a row lookup, and new bars are
+    # added in O(windows) each instead of recomputing the whole series.
+    # Matches rolling(window, min_periods=1).mean() and
+    # ewm(span=window, adjust=False, min_periods=1).mean(), gaps included: a
+    # missing value carries the previous EMA forward, and the previous EMA
+    # keeps decaying through the gap as pandas' default ignore_na=False does.
+
+    def __init__(self, values, windows=WINDOWS):
+        self.windows = np.asarray(windows)
+        self.alphas = 2 / (self.windows + 1)
+        self.size = 0
+        self.values = np.empty(0)
+        self._sums = np.zeros(1) # Cumulative sum of the non missing values, with a leading 0
+        self._counts = np.zeros(1, dtype=np.int64) # Cumulative count of them
+        self._sma = np.empty((len(self.windows), 0))
+        self._ema = np.empty((len(self.windows), 0))
+        self.append(values)
+
+    def sma(self, window):
+        # A copy, the engine is shared with other sessions
+        return self._sma[self._row(window), :self.size].copy()
+
+    def ema(self, window):
+        return self._ema[self._row(window), :self.size].copy()
+
+    def _row(self, window):
+        return int(np.searchsorted(self.windows, window))
+
+    def _reserve(self, size):
+        if size <= len(self.values):
+            return
+        capacity = max(size, 2 * len(self.values), 64)
+        self.values = _grow(self.values, capacity)
+        self._sums = _grow(self._sums, capacity + 1)
+        self._counts = _grow(self._counts, capacity + 1)
+        self._sma = _grow(self._sma, capacity)
+        self._ema = _grow(self._ema, capacity)
+
+    def append(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        start, end = self.size, self.size + len(values)
+        if start == end:
+            return
+        self._reserve(end)
+        self.values[start:end] = values
+
+        missing = np.isnan(values)
+        self._sums[start + 1:end + 1] = self._sums[start] + np.cumsum(np.where(missing, 0, values))
+        self._counts[start + 1:end + 1] = self._counts[start] + np.cumsum(~missing)
+
+        # SMA for every (window, bar) pair in one shot from the cumulative sums
+        idx = np.arange(start, end)
+        low = np.maximum(idx[None, :] + 1 - self.windows[:, None], 0)
+        counts = self._counts[idx + 1][None, :] - self._counts[low]
+        sums = self._sums[idx + 1][None, :] - self._sums[low]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._sma[:, start:end] = np.where(counts > 0, sums / counts, np.nan)
+
+        # EMA is recursive in time. A few new bars step every window at once,
+        # a long run is handed to pandas seeded with the last EMA of each window
+        # and the gap since the last value.
+        previous = self._ema[:, start - 1] if start else np.full(len(self.windows), np.nan)
+        gap = 0 # Missing values since the last one, the previous EMA decays over each
+        if not np.isnan(previous[0]):
+            while np.isnan(self.values[start - 1 - gap]):
+                gap += 1
+        if len(values) <= SHORT_APPEND:
+            for i, value in enumerate(values, start):
+                if np.isnan(value):
+                    current = previous
+                    gap += 1
+                elif np.isnan(previous[0]):
+                    current = np.full(len(self.windows), value)
+                else:
+                    decay = (1 - self.alphas) ** (gap + 1)
+                    current = (decay * previous + self.alphas * value) / (decay + self.alphas)
+                    gap = 0
+                self._ema[:, i] = current
+                previous = current
+        else:
+            for row, alpha in enumerate(self.alphas):
+                seeded = pd.Series(np.concatenate([previous[row:row + 1], np.full(gap, np.nan), values]))
+                self._ema[row, start:end] = seeded.ewm(alpha=alpha, adjust=False).mean().to_numpy()[1 + gap:]
+
+        self.size = end
+
+    def truncate(self, size):
+        self.size = min(size, self.size)
+
+    def sync(self, values):
+        # Brings the engine in line with values: keeps the common prefix,
+        # recomputes from the first bar that changed (eg: today's forming bar)
+        values = np.asarray(values, dtype=np.float64)
+        common = min(self.size, len(values))
+        old, new = self.values[:common], values[:common]
+        changed = np.flatnonzero((old != new) & ~(np.isnan(old) & np.isnan(new)))
+        keep = changed[0] if len(changed) else common
+        self.truncate(keep)
+        self.append(values[keep:])
+        return self
+
+
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+
+
+def moving_averages(name, values):
+    # Process-wide engine for a series, kept in step with the latest values
+    with _engines_lock:
+        engine = _engines.pop(name, None)
+        if engine is None:
+            engine = MovingAverages(values)
+        else:
+            engine.sync(values)
+        _engines[name] = engine
+        while len(_engines) > MAX_ENGINES:
+            _engines.popitem(last=False)
+        return engine
+
+
+# ---- TECHNICAL INDICATORS ----
+# Each takes NumPy columns and returns {trace name: array} aligned with the input.
+
+def _ewm(values, alpha):
+    # Recursive smoothing stays in compiled code
+    return pd.Series(values).ewm(alpha=alpha, adjust=False, ignore_na=True).mean().to_numpy()
+
+
+def _rolling_windows(values, window):
+    # (n - window + 1, window) view, no copy
+    return np.lib.stride_tricks.sliding_window_view(values, window)
+
+
+def _pad(values, n):
+    # Left pad with NaN up to n bars, for windows that are not full yet
+    return np.concatenate([np.full(n - len(values), np.nan), values])
+
+
+def rsi(close, period=14):
+    # Wilder's smoothing of the average gain and loss
+    delta = np.diff(close)
+    gain = _ewm(np.where(delta > 0, delta, 0.0), 1 / period)
+    loss = _ewm(np.where(delta < 0, -delta, 0.0), 1 / period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = 100 - 100 / (1 + gain / loss)
+    return {'RSI': _pad(values, len(close))}
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = _ewm(close, 2 / (fast + 1)) - _ewm(close, 2 / (slow + 1))
+    signal_line = _ewm(line, 2 / (signal + 1))
+    return {'MACD': line, 'Signal': signal_line, 'Histogram': line - signal_line}
+
+
+def bollinger(close, window=20, k=2):
+    if len(close) < window:
+        empty = np.full(len(close), np.nan)
+        return {'BB upper': empty, 'BB middle': empty, 'BB lower': empty}
+    windows = _rolling_windows(close, window)
+    middle = _pad(windows.mean(axis=1), len(close))
+    width = k * _pad(windows.std(axis=1), len(close))
+    return {'BB upper': middle + width, 'BB middle': middle, 'BB lower': middle - width}
+
+
+def atr(high, low, close, period=14):
+    previous = np.concatenate([[np.nan], close[:-1]])
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    return {'ATR': _ewm(true_range, 1 / period)}
+
+
+def vwap(high, low, close, volume, window=20):
+    # Rolling VWAP of the typical price over the last window bars
+    volume = volume.astype(np.float64)
+    traded = np.concatenate([[0.0], np.cumsum((high + low + close) / 3 * volume)])
+    shares = np.concatenate([[0.0], np.cumsum(volume)])
+    low_idx = np.maximum(np.arange(1, len(close) + 1) - window, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'VWAP': (traded[1:] - traded[low_idx]) / (shares[1:] - shares[low_idx])}
+
+
+def volatility(close, window=20, periods_per_year=252):
+    # Annualized standard deviation of log returns (NaN around non positive prices)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.diff(np.log(close))
+    if len(returns) < window:
+        return {'Volatility': np.full(len(close), np.nan)}
+    values = _rolling_windows(returns, window).std(axis=1, ddof=1) * np.sqrt(periods_per_year)
+    return {'Volatility': _pad(values, len(close))}
+
+
+# name: (function, input columns, params, drawn over the price or in its own panel)
+TECHNICAL_INDICATORS = {
+    'Bollinger Bands': (bollinger, ('close',), {'window': 20, 'k': 2}, 'overlay'),
+    'VWAP': (vwap, ('high', 'low', 'close', 'volume'), {'window': 20}, 'overlay'),
+    'RSI': (rsi, ('close',), {'period': 14}, 'panel'),
+    'MACD': (macd, ('close',), {'fast': 12, 'slow': 26, 'signal': 9}, 'panel'),
+    'ATR': (atr, ('high', 'low', 'close'), {'period': 14}, 'panel'),
+    'Volatility': (volatility, ('close',), {'window': 20}, 'panel'),
+}
+MAX_RESULTS = 256 # Indicator results kept across sessions
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+
+def available_indicators(columns):
+    # The moving averages plus whatever the frame has the inputs for
+    return ['SMA', 'EMA'] + [
+        name for name, (_, inputs, _, _) in TECHNICAL_INDICATORS.items()
+        if all(col in columns for col in inputs)
+    ]
+
+
+def series_version(df, price='close'):
+    # Cheap identity of a series' content: a new or revised bar changes it
+    dates = df['date']
+    return (len(df), str(dates.iloc[0]), str(dates.iloc[-1]), float(df[price].iloc[-1])) if len(df) else (0,)
+
+
+def compute_indicator(name, series, df, price='close', **params):
+    # Cached by (series, version, indicator, params), shared by every session
+    function, inputs, defaults, _ = TECHNICAL_INDICATORS[name]
+    params = {**defaults, **params}
+    key = (series, series_version(df, price), name, tuple(sorted(params.items())))
+
+    with _results_lock:
+        if key in _results:
+            _results.move_to_end(key)
+            return _results[key]
+
+    columns = [df[price if col == 'close' else col].to_numpy(dtype=np.float64) for col in inputs]
+    result = function(*columns, **params)
+
+    with _results_lock:
+        _results[key] = result
+        while len(_results) > MAX_RESULTS:
+            _results.popitem(last=False)
+
+    return result
+
+
+def indicator_traces(names, series, df, price='close', last=None, params=None):
+    # Splits the selected indicators into price overlays and extra panels.
+    # last keeps only the final bars, after computing over the whole series.
+    overlays = {}
+    panels = {}
+    for name in names:
+        if name not in TECHNICAL_INDICATORS:
+            continue
+        result = compute_indicator(name, series, df, price, **(params or {}).get(name, {}))
+        if last is not None:
+            result = {trace: values[-last:] for trace, values in result.items()}
+        if TECHNICAL_INDICATORS[name][3] == 'overlay':
+            overlays.update(result)
+        else:
+            panels[name] = result
+    return overlays, panels
+
+
+def performance(close, periods_per_year=252):
+    # Summary of a price series over its whole length, in percent
+    close = np.asarray(close, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.diff(np.log(close))
+        drawdown = close / np.fmax.accumulate(close) - 1
+    return {
+        'Return %': (close[-1] / close[0] - 1) * 100 if len(close) else np.nan,
+        'Volatility %': np.nanstd(returns, ddof=1) * np.sqrt(periods_per_year) * 100 if len(returns) > 1 else np.nan,
+        'Max drawdown %': np.nanmin(drawdown) * 100 if len(close) else np.nan,
+    }
@@ -1,4 +1,8 @@
 import streamlit as st
+from scheduler import scheduler
+from cache import response_cache
+from workers import market_status, prefetcher
+from memo import memo_cache
 
 # --- PAGE SETUP ---
 
@@ -21,11 +25,39 @@ page_3 = st.Page(
     icon=":material/landscape:",
 )
 
+page_4 = st.Page(
+    "views/Page_4.py",
+    title="Watchlist",
+    icon=":material/compare_arrows:",
+)
+
+
+pg = st.navigation(pages=[page_1, page_2, page_3, page_4])
 
-pg = st.navigation(pages=[page_1, page_2, page_3])
+# --- BACKGROUND WORKERS ---
+@st.cache_resource
+def start_workers():
+    # Runs once per process, whatever the number of sessions
+    market_status.start()
+    prefetcher.start()
+
+start_workers()
 
 # --- SHARED ON ALL PAGES ---
 st.logo("imgs/logo.png")
 
+quota = scheduler.quota()
+st.sidebar.caption(f"API quota left: {quota['minute']}/min, {quota['day']}/day ({quota['queued']} queued, {quota['collapsed']} shared)")
+cache_stats = response_cache.stats()
+st.sidebar.caption(f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['bytes'] / 1e6:.1f} MB")
+memo_stats = memo_cache.stats()
+st.sidebar.caption(f"Memory: {memo_stats['entries']} results, {memo_stats['bytes'] / 1e6:.1f} of {memo_stats['budget'] / 1e6:.0f} MB, "
+                   f"{memo_stats['hits']} hits at {memo_stats['hit_seconds'] * 1e6:.0f} µs")
+st.sidebar.toggle(
+    "Binary chart data",
+    key='binary_charts',
+    help="Sends chart data as typed arrays instead of JSON text. Smaller, but drawn without the app's theme."
+)
+
 # --- RUN NAVIGATION ---
 pg.run()
\ No newline at end of file
@@ -0,0 +1,157 @@
+import functools
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from functions import ApiNotice
+from cache import is_cacheable
+
+MEMORY_BUDGET = 256 * 1024 * 1024 # Least recently used results are evicted above this
+
+
+def sizeof(value):
+    # Bytes a result holds, arrays by their buffers. Memory-mapped arrays
+    # live in the page cache, not in the process, and count for nothing.
+    if isinstance(value, np.memmap) or (isinstance(value, np.ndarray) and isinstance(value.base, np.memmap)):
+        return sys.getsizeof(value)
+    if isinstance(value, np.ndarray):
+        # getsizeof counts the buffer of an array that owns it, not of a view
+        return sys.getsizeof(value) + (value.nbytes if value.base is not None else 0)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def freeze(value):
+    # Hashable stand-in for an argument, by content like st.cache_data
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.dtype.str, value.shape, hashlib.blake2b(np.ascontiguousarray(value).tobytes()).digest())
+    if isinstance(value, pd.DataFrame):
+        return ('DataFrame', tuple(value.columns), int(pd.util.hash_pandas_object(value).sum()))
+    if isinstance(value, dict):
+        return ('dict',) + tuple((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(freeze(v) for v in value)
+    return value
+
+
+def read_only(value):
+    # Results are shared by every session, arrays are locked against writes
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for v in value.values():
+            read_only(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            read_only(v)
+    return value
+
+
+class MemoCache:
+    # Results of the pages' fetchers, held as the objects they are: a hit is
+    # a dictionary lookup, where st.cache_data unpickles a copy every time.
+    # Every entry counts against one budget for the process, the least
+    # recently used go first.
+
+    def __init__(self, budget=MEMORY_BUDGET):
+        self.budget = budget
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_seconds = 0.0 # Spent answering hits, key included
+        self._entries = OrderedDict() # key -> (value, size, expires)
+        self._lock = threading.Lock()
+
+    def get(self, key, since=None):
+        # Returns (found, value). since is when the caller started on the
+        # lookup, a hit then counts the time spent from there.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if since is not None:
+                self.hit_seconds += time.perf_counter() - since
+            return True, entry[0]
+
+    def put(self, key, value, ttl):
+        size = sizeof(value)
+        if size > self.budget:
+            return # Would evict everything else
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time() + ttl)
+            self.bytes += size
+            while self.bytes > self.budget:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'budget': self.budget,
+                'hit_seconds': self.hit_seconds / self.hits if self.hits else 0.0
+            }
+
+
+# One cache per process, shared by every session and page
+memo_cache = MemoCache()
+
+
+def memoize(ttl):
+    # Drop-in for st.cache_data(ttl=...) on the pages' fetchers, ttl in seconds.
+    # Results must not be modified: arrays are made read-only, build a frame
+    # from them instead. Fetchers raise ApiNotice on a notice, exceptions are
+    # not cached; a notice returned as a result is raised the same way.
+    # Fetchers of one item among many (a symbol of a bulk load) are better
+    # left plain: they return their notice so the page can leave the item out,
+    # and the disk cache and bar stores already keep their data, with calls
+    # in flight collapsed across sessions.
+    def decorator(func):
+        # Pages all run as __main__, the file tells their functions apart
+        name = (func.__code__.co_filename, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            start = time.perf_counter()
+            found, value = memo_cache.get((name, freeze(args)), since=start)
+            if found:
+                return value
+            value = func(*args)
+            if isinstance(value, dict) and not is_cacheable(value):
+                raise ApiNotice(value)
+            value = read_only(value)
+            memo_cache.put((name, freeze(args)), value, ttl)
+            return value
+
+        return wrapper
+
+    return decorator
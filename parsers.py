@@ -0,0 +1,185 @@
+import codecs
+import itertools
+import json
+import re
+import numpy as np
+import pandas as pd
+
+
+def series_key(json_data):
+    # 'Time Series (Daily)', 'Time Series FX (Daily)', 'Time Series (Digital Currency Daily)', ...
+    if 'data' in json_data:
+        return 'data'
+    return next(key for key in json_data if key.startswith('Time Series'))
+
+
+def parse_dates(keys):
+    # Daily keys are 'YYYY-MM-DD', intraday keys carry a time as well
+    keys = list(keys)
+    unit = 'D' if keys and len(keys[0]) == 10 else 's'
+    return np.array(keys, dtype=f'datetime64[{unit}]')
+
+
+def parse_columns(json_data):
+    # Returns (title, dates, columns) with typed NumPy columns sorted by ascending date.
+    # Numbers go straight from the JSON strings into one flat float64 buffer,
+    # no transposed DataFrame of strings on the way.
+    key = series_key(json_data)
+
+    if key == 'data':
+        # Commodities: [{'date': ..., 'value': ...}, ...], '.' marks a missing value
+        data = json_data[key]
+        dates = parse_dates(row['date'] for row in data)
+        values = np.array([row['value'] for row in data])
+        # np.where widens the string dtype, assigning 'nan' into an all '.' array would keep only 'n'
+        columns = {'value': np.where(values == '.', 'nan', values).astype(np.float64)}
+        title = json_data.get('name', '')
+    else:
+        series = json_data[key]
+        names = [col.split('. ', 1)[1] for col in next(iter(series.values()), {})]
+        dates = parse_dates(series)
+        values = np.fromiter(
+            map(float, itertools.chain.from_iterable(row.values() for row in series.values())),
+            dtype=np.float64,
+            count=len(series) * len(names)
+        ).reshape(len(series), len(names))
+        columns = {name: values[:, i] for i, name in enumerate(names)}
+        title = json_data['Meta Data']['1. Information']
+
+    return (title,) + _sorted_columns(dates, columns)
+
+
+def _sorted_columns(dates, columns):
+    if 'volume' in columns and np.all(np.mod(columns['volume'], 1) == 0):
+        columns['volume'] = columns['volume'].astype(np.int64) # Share volumes are whole
+
+    # Alpha Vantage lists the newest bar first
+    if len(dates) > 1 and dates[0] > dates[-1]:
+        dates = dates[::-1]
+        columns = {name: col[::-1] for name, col in columns.items()}
+    if np.any(dates[1:] < dates[:-1]):
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        columns = {name: col[order] for name, col in columns.items()}
+
+    columns = {name: np.ascontiguousarray(col) for name, col in columns.items()}
+
+    return dates, columns
+
+
+STREAM_CHUNK = 64 * 1024
+
+# Tokens of the two payload layouts, matched chunk by chunk as the body arrives
+_TITLE = re.compile(r'"1\. Information"\s*:\s*"([^"]*)"|"name"\s*:\s*"([^"]*)"')
+_SERIES_START = re.compile(r'"(Time Series[^"]*|data)"\s*:\s*[{\[]')
+_BAR = re.compile(r'"(\d{4}-\d{2}-\d{2}(?: \d{2}:\d{2}:\d{2})?)"\s*:\s*\{([^{}]*)\}')
+_FIELD = re.compile(r'"\w+\. ([^"]+)"\s*:\s*"([^"]*)"')
+_POINT = re.compile(r'\{\s*"date"\s*:\s*"([^"]+)"\s*,\s*"value"\s*:\s*"([^"]*)"\s*\}')
+
+
+def stream_columns(response, limit=None):
+    # Same result as parse_columns(response.json()), but the body is read in
+    # chunks and rows are written straight into preallocated arrays. With a
+    # limit, reading stops (and the connection is dropped) after that many of
+    # the newest rows. Notices and errors come back as the plain JSON dict.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    head = '' # Everything before the series, kept to read the title or a notice
+    buffer = ''
+    title = ''
+    key = None
+    names = None
+    size = 0
+    capacity = limit or 1024 # Doubled whenever the rows outgrow it
+    dates = []
+    values = None
+
+    try:
+
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK):
+            buffer += decoder.decode(chunk)
+
+            if key is None:
+                match = _SERIES_START.search(buffer)
+                if match is None:
+                    continue
+                key = match.group(1)
+                head, buffer = buffer[:match.start()], buffer[match.end():]
+                match = _TITLE.search(head)
+                title = (match.group(1) or match.group(2)) if match else ''
+
+            pattern = _POINT if key == 'data' else _BAR
+            matches = list(pattern.finditer(buffer))
+            if limit is not None:
+                matches = matches[:limit - size]
+            if not matches:
+                continue
+
+            # Convert the whole chunk at once instead of row by row
+            if key == 'data':
+                names = ['value']
+                raw = np.array([match.group(2) for match in matches])
+            else:
+                names = names or [name for name, _ in _FIELD.findall(matches[0].group(2))]
+                raw = np.array([value for match in matches for _, value in _FIELD.findall(match.group(2))])
+            # A chunk can hold only '.' values, np.where widens the dtype to fit 'nan'
+            block = np.where(raw == '.', 'nan', raw).astype(np.float64).reshape(len(matches), len(names))
+
+            if values is None:
+                values = np.empty((max(capacity, len(block)), len(names)), dtype=np.float64)
+            while size + len(block) > len(values):
+                values = np.resize(values, (2 * len(values), len(names)))
+
+            values[size:size + len(block)] = block
+            dates.extend(match.group(1) for match in matches)
+            size += len(block)
+            buffer = buffer[matches[-1].end():]
+
+            if limit is not None and size >= limit:
+                break
+
+    finally:
+
+        response.close()
+
+    if key is None:
+        # No series in the body, so it is a notice, an error or a payload we do not know
+        try:
+            return json.loads(head + buffer)
+        except ValueError:
+            return {'Information': 'Alpha Vantage returned an invalid response. Please try again later.'}
+
+    dates, columns = _sorted_columns(
+        parse_dates(dates),
+        {name: values[:size, i] for i, name in enumerate(names or [])}
+    )
+
+    return {'title': title, 'dates': dates, 'columns': columns}
+
+
+def to_records(dates, columns):
+    # One structured array, the layout the bar store keeps on disk
+    records = np.empty(len(dates), dtype=[('date', dates.dtype)] + [(name, col.dtype) for name, col in columns.items()])
+    records['date'] = dates
+    for name, col in columns.items():
+        records[name] = col
+    return records
+
+
+def to_compact(records):
+    # What a page caches of a series: dates as int64 days since the epoch and
+    # every other column as float64, no strings and no frame
+    return {
+        'dates': records['date'].astype('datetime64[D]').astype(np.int64),
+        'columns': {name: records[name].astype(np.float64) for name in records.dtype.names if name != 'date'}
+    }
+
+
+def compact_nbytes(compact):
+    # Bytes held by a to_compact result
+    return compact['dates'].nbytes + sum(col.nbytes for col in compact['columns'].values())
+
+
+def parse_time_series(json_data):
+    # Typed DataFrame with a DatetimeIndex named 'date', oldest bar first
+    _, dates, columns = parse_columns(json_data)
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(dates, name='date'))
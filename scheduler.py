@@ -0,0 +1,316 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functions import request_alphavantage, request_json, UNREACHABLE
+from cache import response_cache, ttl_for, is_cacheable
+
+# Alpha Vantage free tier limits, raise them for a premium key
+REQUESTS_PER_MINUTE = 5
+REQUESTS_PER_DAY = 25
+
+# Lower value is served first
+PRIORITY_HIGH = 0 # Visible on first paint (quotes, search)
+PRIORITY_NORMAL = 1 # Charts
+PRIORITY_LOW = 2 # Expanders and background work
+
+
+def request_key(params):
+    # Same request whatever the argument order, the API key is not part of it
+    return tuple(sorted((k, str(v)) for k, v in params.items() if k != 'apikey'))
+
+
+def is_rate_limited(json_data):
+    notice = json_data.get('Information') or json_data.get('Note') or ''
+    return 'rate limit' in notice.lower() or 'requests per' in notice.lower()
+
+
+class TokenBucket:
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        # Returns 0 when a token was taken, otherwise the seconds to wait for one
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        # The server says we are over the limit, so back off for a full minute
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - self.capacity + 1
+
+    @property
+    def remaining(self):
+        with self.lock:
+            self._refill()
+            return max(int(self.tokens), 0)
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one run of the function: the
+    # first caller runs it, the others wait for its result or its exception.
+
+    def __init__(self):
+        self.collapsed = 0
+        self._calls = {} # key -> Future, while the first caller runs
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, on_join=None):
+        # on_join runs for every caller that waits on another's run
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            if on_join is not None:
+                on_join()
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as error:
+            self._done(key)
+            future.set_exception(error)
+            raise
+        self._done(key)
+        future.set_result(result)
+        return result
+
+    def _done(self, key):
+        with self._lock:
+            del self._calls[key]
+
+
+class RequestScheduler:
+
+    def __init__(self, per_minute=REQUESTS_PER_MINUTE, per_day=REQUESTS_PER_DAY, workers=4):
+        self.per_day = per_day
+        self.bucket = TokenBucket(per_minute)
+        self.day = None
+        self.used_today = 0
+        self.collapsed = 0
+        self.flights = SingleFlight() # Whole fetches (cache, request, parse) in flight
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._pending = {} # key -> params, not dispatched yet
+        self._inflight = {} # key -> Future, until the response is in
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='alphavantage')
+        self._thread = None
+
+    def submit(self, priority=PRIORITY_NORMAL, parse=None, limit=None, **params):
+        # parse(response, limit) reads a streamed body, otherwise the result is the JSON dict
+        key = request_key(params) + (((parse.__name__, limit),) if parse else ())
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name='alphavantage-scheduler', daemon=True)
+                self._thread.start()
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.collapsed += 1
+                if key in self._pending:
+                    # Queue it again so a higher priority caller is not held back,
+                    # the dispatcher ignores whichever entry comes second
+                    self._queue.put((priority, next(self._sequence), key))
+                return future
+
+            future = Future()
+            self._inflight[key] = future
+            self._pending[key] = (params, parse, limit)
+
+        self._queue.put((priority, next(self._sequence), key))
+
+        return future
+
+    def fetch(self, priority=PRIORITY_NORMAL, parse=None, limit=None, **params):
+        return self.submit(priority, parse, limit, **params).result()
+
+    def promote(self, priority, **params):
+        # Queues pending requests for these params (and any extra ones, eg:
+        # outputsize) again at priority, without ever sending a new request
+        wanted = set(request_key(params))
+        with self._lock:
+            keys = [key for key in self._pending if wanted <= set(key)]
+        for key in keys:
+            self._queue.put((priority, next(self._sequence), key))
+
+    def quota(self):
+        with self._lock:
+            self._roll_day()
+            return {
+                'minute': self.bucket.remaining,
+                'day': max(self.per_day - self.used_today, 0),
+                'queued': len(self._pending),
+                'collapsed': self.collapsed + self.flights.collapsed
+            }
+
+    def _roll_day(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+
+            with self._lock:
+                if item[2] not in self._pending:
+                    continue
+                self._roll_day()
+                day_exhausted = self.used_today >= self.per_day
+
+            if day_exhausted:
+                self._finish(item[2], {'Information': 'The daily Alpha Vantage quota has been reached. Please try again tomorrow.'})
+                continue
+
+            wait = self.bucket.take()
+            if wait:
+                # Put it back, a higher priority request may arrive while we wait
+                self._queue.put(item)
+                time.sleep(wait)
+                continue
+
+            with self._lock:
+                params, parse, limit = self._pending.pop(item[2])
+                self.used_today += 1
+
+            self._executor.submit(self._run, item[2], params, parse, limit)
+
+    def _run(self, key, params, parse=None, limit=None):
+        try:
+
+            if parse is None:
+                json_data = request_json(**params)
+            else:
+                response = request_alphavantage(stream=True, **params)
+                if response is None:
+                    json_data = {'Information': UNREACHABLE}
+                else:
+                    json_data = parse(response, limit)
+
+        except Exception as error:
+
+            self._finish(key, error=error)
+            return
+
+        if is_rate_limited(json_data):
+            self.bucket.drain()
+
+        self._finish(key, json_data)
+
+    def _finish(self, key, json_data=None, error=None):
+        with self._lock:
+            self._pending.pop(key, None)
+            future = self._inflight.pop(key)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(json_data)
+
+
+# One scheduler per process, shared by every page and every browser session
+scheduler = RequestScheduler()
+
+
+class Revalidator:
+    # Background refreshes for stale-while-revalidate, at most one per key at a time
+
+    def __init__(self, workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='revalidate')
+        self._running = {} # key -> Future
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                return future
+            future = self._running[key] = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._running.get(key) is future:
+                del self._running[key]
+
+
+revalidator = Revalidator()
+
+
+def cache_key(params):
+    return '&'.join(f'{k}={v}' for k, v in request_key(params))
+
+
+def fetch_alphavantage(priority=PRIORITY_NORMAL, **params):
+    # Disk cache first, the rate-limited scheduler only on a miss. Identical
+    # calls from other sessions share the first one's trip through both.
+    key = cache_key(params)
+    return scheduler.flights.do(
+        key, _fetch_alphavantage, priority, key, params,
+        on_join=lambda: scheduler.promote(priority, **params)
+    )
+
+
+def _fetch_alphavantage(priority, key, params):
+    json_data = response_cache.get(key)
+    if json_data is not None:
+        return json_data
+
+    json_data = scheduler.fetch(priority, **params)
+
+    if is_cacheable(json_data):
+        response_cache.set(key, json_data, ttl_for(params))
+
+    return json_data
+
+
+def fetch_stale(priority=PRIORITY_NORMAL, force=False, **params):
+    # Stale-while-revalidate: returns (json_data, stored, revalidation) at once
+    # when anything is cached, even expired. An expired entry, or any with
+    # force, is refreshed in the background; revalidation is that Future, or
+    # None. A failed or rate limited refresh leaves the cached value in place.
+    key = cache_key(params)
+    entry = response_cache.get_entry(key)
+
+    if entry is None:
+        return fetch_alphavantage(priority, **params), time.time(), None
+
+    json_data, stored, expires = entry
+    if expires > time.time() and not force:
+        return json_data, stored, None
+
+    return json_data, stored, revalidator.submit(key, _revalidate, priority, key, params)
+
+
+def _revalidate(priority, key, params):
+    # Straight to the scheduler, the cache would only hand back the stale entry
+    json_data = scheduler.fetch(priority, **params)
+    if is_cacheable(json_data):
+        response_cache.set(key, json_data, ttl_for(params))
+    return json_data
@@ -0,0 +1,233 @@
+import bisect
+import csv
+import io
+import json
+import os
+import threading
+import time
+from cache import CACHE_DIR, ttl_for
+from scheduler import scheduler, fetch_alphavantage, PRIORITY_HIGH, PRIORITY_LOW
+
+SYMBOLS_PATH = os.path.join(CACHE_DIR, 'symbols.json')
+MAX_MATCHES = 10 # Same as SYMBOL_SEARCH's bestMatches
+SAVE_DELAY = 30 # Seconds a search answer waits to be written, with any others that come in
+
+# LISTING_STATUS assetType to SYMBOL_SEARCH type, the Stock page branches on the latter
+ASSET_TYPES = {'Stock': 'Equity', 'ETF': 'ETF'}
+
+
+def parse_listing(response, limit=None):
+    # LISTING_STATUS answers in CSV: symbol,name,exchange,assetType,ipoDate,delistingDate,status.
+    # Every listed symbol is on a US exchange.
+    try:
+        text = response.text
+    finally:
+        response.close()
+    if text.lstrip().startswith('{'):
+        return json.loads(text) # A notice
+    return {'bestMatches': [
+        {
+            '1. symbol': row['symbol'],
+            '2. name': row['name'],
+            '3. type': ASSET_TYPES.get(row['assetType'], row['assetType']),
+            '4. region': 'United States',
+            '8. currency': 'USD'
+        }
+        for row in csv.DictReader(io.StringIO(text)) if row.get('symbol')
+    ]}
+
+
+def _deletes(word):
+    # Every way to drop one letter, the key of a one-typo match
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _words_of(row):
+    return set(row['2. name'].upper().split())
+
+
+def _index(rows):
+    # (symbols, words, typos) for rows: sorted symbols, sorted (word, symbol)
+    # pairs of every word of every name, one-letter deletions to symbols
+    symbols = sorted(rows)
+    words = sorted((word, symbol) for symbol, row in rows.items() for word in _words_of(row))
+    typos = {}
+    for symbol in symbols:
+        for key in _deletes(symbol) | {symbol}:
+            typos.setdefault(key, []).append(symbol)
+    return symbols, words, typos
+
+
+class SymbolIndex:
+    # Local symbol lookup built from the LISTING_STATUS snapshot and every
+    # SYMBOL_SEARCH answer seen so far. Sorted lists give prefix matches by
+    # bisection, a table of one-letter deletions gives matches with one typo.
+    # Rows keep the SYMBOL_SEARCH layout, so the pages do not see a difference.
+    # A search answer is inserted in place and written out a little later, only
+    # the weekly listing rebuilds the whole index, outside the lock.
+
+    def __init__(self, path=SYMBOLS_PATH):
+        self.path = path
+        self.rows = {} # Symbol: bestMatches row
+        self.listed = 0 # When the listing was last downloaded
+        self._symbols = []
+        self._words = [] # (word, symbol) for every word of every name, sorted
+        self._typos = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # One writer of the file at a time
+        self._saving = False # A delayed save is pending
+        self._loaded = False
+
+    def load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.path) as file:
+                    saved = json.load(file)
+                self.listed = saved['listed']
+                self.rows = saved['rows']
+                self._symbols, self._words, self._typos = _index(self.rows)
+            except (OSError, ValueError):
+                pass
+            self._loaded = True
+
+    def save(self):
+        # Write then rename, so readers never see a half written file
+        with self._lock:
+            self._saving = False
+            saved = {'listed': self.listed, 'rows': dict(self.rows)}
+        with self._save_lock:
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as file:
+                json.dump(saved, file)
+            os.replace(tmp, self.path)
+
+    def _save_soon(self):
+        # Search answers coming in together are written once
+        with self._lock:
+            if self._saving:
+                return
+            self._saving = True
+        timer = threading.Timer(SAVE_DELAY, self.save)
+        timer.daemon = True
+        timer.start()
+
+    def _insert(self, row):
+        # One row into the sorted lists in place, under the lock
+        symbol = row['1. symbol']
+        old = self.rows.get(symbol)
+        self.rows[symbol] = row
+        if old is None:
+            bisect.insort(self._symbols, symbol)
+            for key in _deletes(symbol) | {symbol}:
+                self._typos.setdefault(key, []).append(symbol)
+        else:
+            for word in _words_of(old):
+                del self._words[bisect.bisect_left(self._words, (word, symbol))]
+        for word in _words_of(row):
+            bisect.insort(self._words, (word, symbol))
+
+    def add(self, matches, listed=False):
+        # matches are bestMatches rows. Search answers win over the listing,
+        # they carry the region and currency of non US symbols.
+        self.load()
+        if not listed:
+            with self._lock:
+                for row in matches:
+                    self._insert(row)
+            self._save_soon()
+            return
+
+        with self._lock:
+            rows = dict(self.rows)
+        for row in matches:
+            rows.setdefault(row['1. symbol'], row)
+        index = _index(rows) # The slow part, searches go on meanwhile
+        with self._lock:
+            # Search answers that came in during the build go on top
+            newer = [row for symbol, row in self.rows.items() if rows.get(symbol) is not row]
+            self.rows = rows
+            self._symbols, self._words, self._typos = index
+            for row in newer:
+                self._insert(row)
+            self.listed = time.time()
+        self.save()
+
+    def _prefix(self, keys, low, high):
+        # Range of the sorted keys from low up to, not including, high
+        return bisect.bisect_left(keys, low), bisect.bisect_left(keys, high)
+
+    def search(self, keywords, limit=MAX_MATCHES):
+        # Returns (matches, suggestions). Matches are the exact symbol, then
+        # symbols starting with the keywords, then names with a word starting
+        # with them. Suggestions are symbols one typo away: QQQM is not QQQ,
+        # so they are only offered next to the matches, never instead.
+        self.load()
+        text = ' '.join(keywords.upper().split())
+        if not text:
+            return [], []
+
+        found = []
+        if text in self.rows:
+            found.append(text)
+
+        start, end = self._prefix(self._symbols, text, text + '\uffff')
+        found += sorted(self._symbols[start:min(end, start + 10 * limit)], key=len)
+
+        word = text.split()[0]
+        start, end = self._prefix(self._words, (word,), (word + '\uffff',))
+        found += [
+            symbol for _, symbol in self._words[start:min(end, start + 10 * limit)]
+            if text in self.rows[symbol]['2. name'].upper()
+        ]
+        found = list(dict.fromkeys(found))[:limit]
+
+        typos = []
+        if len(text) > 2: # One typo in two letters could be anything
+            for key in _deletes(text) | {text}:
+                typos += self._typos.get(key, [])
+        typos = [symbol for symbol in dict.fromkeys(sorted(typos)) if symbol not in found][:limit]
+
+        return [self.rows[symbol] for symbol in found], [self.rows[symbol] for symbol in typos]
+
+    def is_stale(self):
+        self.load()
+        return time.time() - self.listed > ttl_for({'function': 'LISTING_STATUS'})
+
+    def refresh(self, priority=PRIORITY_LOW):
+        # Downloads the listing once it is a week old, a single call for every US symbol
+        if not self.is_stale():
+            return
+        json_data = scheduler.fetch(priority, parse=parse_listing, function='LISTING_STATUS')
+        if json_data.get('bestMatches'):
+            self.add(json_data['bestMatches'], listed=True)
+
+
+# One index per process, the file outlives it
+symbol_index = SymbolIndex()
+
+
+def search_symbols(keywords, priority=PRIORITY_HIGH):
+    # SYMBOL_SEARCH answered locally when a symbol or name matches. Anything
+    # else goes to the API, and its matches are kept for next time. Local
+    # symbols one typo away fill up the list either way.
+    matches, suggestions = symbol_index.search(keywords)
+    if matches:
+        return {'bestMatches': (matches + suggestions)[:MAX_MATCHES]}
+
+    json_data = fetch_alphavantage(
+        priority=priority,
+        function='SYMBOL_SEARCH',
+        keywords=keywords
+    )
+    if json_data.get('bestMatches'):
+        symbol_index.add(json_data['bestMatches'])
+        seen = {row['1. symbol'] for row in json_data['bestMatches']}
+        suggestions = [row for row in suggestions if row['1. symbol'] not in seen]
+        return {**json_data, 'bestMatches': (json_data['bestMatches'] + suggestions)[:MAX_MATCHES]}
+    if suggestions:
+        return {'bestMatches': suggestions} # Better than an empty answer or a notice
+    return json_data
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from indicators import MovingAverages, WINDOWS, SHORT_APPEND
+
+
+def expected(values, window):
+    series = pd.Series(values)
+    return (
+        series.rolling(window, min_periods=1).mean().to_numpy(),
+        series.ewm(span=window, adjust=False, min_periods=1).mean().to_numpy()
+    )
+
+
+def assert_matches(engine, values):
+    assert engine.size == len(values)
+    for window in WINDOWS:
+        sma, ema = expected(values, window)
+        np.testing.assert_allclose(engine.sma(window), sma, rtol=1e-12, equal_nan=True)
+        np.testing.assert_allclose(engine.ema(window), ema, rtol=1e-12, equal_nan=True)
+
+
+def series(size, gaps=(), seed=0):
+    # A random walk near 10, with values missing at gaps like a commodity's '.'
+    values = 10 + np.cumsum(np.random.default_rng(seed).normal(0, 0.2, size))
+    values[list(gaps)] = np.nan
+    return values
+
+
+@pytest.mark.parametrize('gaps', [(), (0, 1, 50, 51, 52, 120), range(100, 180)])
+def test_build(gaps):
+    values = series(300, gaps)
+    assert_matches(MovingAverages(values), values)
+
+
+@pytest.mark.parametrize('step', [1, SHORT_APPEND, SHORT_APPEND + 1, 100])
+def test_append(step):
+    # Short appends are stepped in Python, long ones by pandas, gaps cross both
+    values = series(400, (3, 40, 41, 42, 97, 98, 200, 333))
+    engine = MovingAverages(values[:10])
+    for start in range(10, len(values), step):
+        engine.append(values[start:start + step])
+    assert_matches(engine, values)
+
+
+@pytest.mark.parametrize('tail', [1, SHORT_APPEND + 5])
+def test_append_after_gap(tail):
+    # The last stored values are missing, the appended ones pick the decay up
+    values = series(200, range(150, 160))
+    engine = MovingAverages(values[:155])
+    engine.append(values[155:155 + tail])
+    assert_matches(engine, values[:155 + tail])
+
+
+def test_sync():
+    values = series(300, (10, 11, 250))
+    engine = MovingAverages(values)
+
+    # Today's forming bar changes, then a new bar comes in
+    values[-1] += 0.5
+    assert_matches(engine.sync(values), values)
+    values = np.append(values, [np.nan, 11.0])
+    assert_matches(engine.sync(values), values)
+
+    # A revised bar far back recomputes from there
+    values[20] = 9.0
+    assert_matches(engine.sync(values), values)
@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import parsers
+from parsers import parse_columns, stream_columns
+
+
+class ChunkedResponse:
+    # A streamed response whose body comes in chunks of the requested size
+    def __init__(self, body):
+        self.body = body.encode()
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def commodity_payload(values):
+    data = [{'date': f'2024-01-{day:02d}', 'value': value} for day, value in enumerate(values, 1)]
+    return {'name': 'Test Commodity', 'interval': 'daily', 'unit': 'dollars', 'data': data}
+
+
+def test_parse_columns_all_missing():
+    _, dates, columns = parse_columns(commodity_payload(['.', '.']))
+    assert len(dates) == 2
+    assert np.isnan(columns['value']).all()
+
+
+def test_stream_columns_chunk_of_only_missing_values(monkeypatch):
+    # Small chunks so the trailing '.' values arrive in blocks of their own
+    monkeypatch.setattr(parsers, 'STREAM_CHUNK', 32)
+    payload = commodity_payload(['1.5', '2.25'] + ['.'] * 8)
+    result = stream_columns(ChunkedResponse(json.dumps(payload)))
+
+    _, dates, columns = parse_columns(payload)
+    assert result['title'] == 'Test Commodity'
+    np.testing.assert_array_equal(result['dates'], dates)
+    np.testing.assert_array_equal(result['columns']['value'], columns['value'])
+    assert np.isnan(result['columns']['value']).sum() == 8
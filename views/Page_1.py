@@ -1,78 +1,175 @@
+import numpy as np
 import streamlit as st
-from datetime import datetime
 import pandas as pd
-from functions import request_alphavantage
+from scheduler import fetch_alphavantage, fetch_stale, is_cacheable, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
 from functions import plot_candles_stick_bar
+from functions import visible_range, downsample_candles, RANGES
+from functions import show_chart
+from functions import format_age
+from functions import update_last_bar
+from functions import tail_bars, hide_closed_hours
+from functions import fetch_concurrently, ApiNotice
+from bars import bar_store, intraday_store, INTRADAY_INTERVALS
+from symbols import search_symbols
+from workers import market_status, quote_poller, quote_price
+from indicators import moving_averages, available_indicators, indicator_traces
 from contact import contact_form
+from memo import memoize
+from cache import DAY, WEEK
+
+# What the page shows of OVERVIEW and ETF_PROFILE, the only parts kept in memory
+OVERVIEW_FIELDS = ('Country', 'Exchange', 'Sector', 'Industry', 'MarketCapitalization', 'EBITDA', 'Beta')
+ETF_FIELDS = ('net_assets', 'net_expense_ratio', 'portfolio_turnover', 'dividend_yield', 'inception_date',
+              'asset_allocation', 'sectors')
 
-@st.cache_data
 def fetch_symbol_search(keywords):
-    json_data = request_alphavantage(
-        function='SYMBOL_SEARCH',
-        keywords=keywords,
-        apike=API_KEY
-    ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
+    # Answered from the local symbol index, the API only sees keywords no symbol or name starts with
+    json_data = search_symbols(keywords, priority=PRIORITY_HIGH)
+    if not is_cacheable(json_data):
+        st.warning(str(ApiNotice(json_data)))
         st.stop()
     return json_data
 
-@st.cache_data
-def fetch_time_series_daily(ticker):
-    json_data = request_alphavantage(
+# The fetchers below run in fetch_concurrently's workers
+def fetch_time_series_daily(ticker, refresh=False):
+    # Full history from the local bar store, only new bars are downloaded.
+    # Stored bars show at once while newer ones are fetched in the background.
+    json_data, revalidation = bar_store.update_stale(
+        priority=PRIORITY_NORMAL,
+        force=refresh,
         function='TIME_SERIES_DAILY',
         symbol=ticker,
-        outputsize='compact', # compact returns only the latest 100 data points
         datatype='json'
-        ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
+        )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    return json_data, json_data['Meta Data']['updated'], revalidation
+
+# Not memoized: the bars are already in memory, and the store
+# knows when the last one is due
+def fetch_intraday(ticker, interval):
+    # 1-minute bars kept in memory, the longer intervals are resampled from them
+    json_data = intraday_store.bars(
+        ticker,
+        INTRADAY_INTERVALS[interval],
+        priority=PRIORITY_NORMAL
+        )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    return json_data, json_data['Meta Data']['updated'], None
 
-@st.cache_data
+@memoize(ttl=WEEK)
 def fetch_splits_events(ticker):
-    json_data = request_alphavantage(
+    json_data = fetch_alphavantage(
+        priority=PRIORITY_LOW,
         function='SPLITS',
         symbol=ticker,
-        ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
-
-@st.cache_data
+        )
+    if not is_cacheable(json_data): # Checked before the notice is turned into a frame
+        raise ApiNotice(json_data)
+    # A typed frame rather than the answer's list of strings
+    data = json_data.get('data', [])
+    return pd.DataFrame({
+        'effective_date': np.array([row['effective_date'] for row in data], dtype='datetime64[D]'),
+        'split_factor': np.array([row['split_factor'] for row in data], dtype=np.float64)
+    })
+
+@memoize(ttl=DAY)
 def fetch_overview(ticker):
-    json_data = request_alphavantage(
+    json_data = fetch_alphavantage(
+        priority=PRIORITY_LOW,
         function='OVERVIEW',
         symbol=ticker,
-        ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
+        )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    return {key: json_data.get(key) for key in OVERVIEW_FIELDS}
 
-@st.cache_data
+@memoize(ttl=DAY)
 def fetch_etf_profile(ticker):
-    json_data = request_alphavantage(
+    json_data = fetch_alphavantage(
+        priority=PRIORITY_LOW,
         function='ETF_PROFILE',
         symbol=ticker,
-        ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
-
-@st.cache_data
-def fetch_quote_endpoint(ticker):
-    json_data = request_alphavantage(
+        )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    return {key: json_data.get(key) for key in ETF_FIELDS} # Holdings left out
+
+def fetch_quote_endpoint(ticker, refresh=False):
+    # The last quote shows at once, even expired, while a new one is fetched
+    # in the background. Only with no quote at all does the page wait.
+    json_data, stored, revalidation = fetch_stale(
+        priority=PRIORITY_HIGH,
+        force=refresh,
         function='GLOBAL_QUOTE',
         symbol=ticker,
-        ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
+        )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    return json_data, stored, revalidation
+
+def show_quote(data):
+    # Metrics of a GLOBAL_QUOTE
+    PRICE = float(data['05. price'])
+    CHANGE = float(data['09. change'])
+    CHANGE_PER = float(data['10. change percent'].strip('%'))
+    HIGH = float(data['03. high'])
+    LOW = float(data['04. low'])
+    VOLUME = int(data['06. volume'])
+    LATEST_DATE = data['07. latest trading day']
+
+    st.metric(
+        "Latest Price",
+        value=f'{PRICE:.1f} USD',
+        delta=f'{CHANGE:.1f} ({CHANGE_PER:.2f}%)'
+        )
+
+
+    col1, col2, col3 = st.columns(3, gap="medium")
+
+    col1.metric(
+        "High",
+        value=f'{HIGH:.1f} USD'
+        )
+
+    col2.metric(
+        "Low",
+        value=f'{LOW:.1f} USD'
+    )
+
+    col3.metric(
+        "Volume",
+        value=f'{VOLUME}'
+    )
+
+    st.write("Latest update:", LATEST_DATE)
+
+@st.fragment(run_every=quote_poller.interval())
+def live_quote(ticker, resolution):
+    # Metrics and the last candle from the polled quote
+    json_data, updated, ring = quote_poller.watch(function='GLOBAL_QUOTE', symbol=ticker)
+    if quote_price(json_data) is None:
+        st.warning(str(ApiNotice(json_data)) if not is_cacheable(json_data) else 'No quote available yet.')
+        return
+
+    data = json_data['Global Quote']
+    show_quote(data)
+    st.caption(f"Live: {format_age(updated)}, {ring.count} quotes polled")
+
+    fig = st.session_state.get('fig_stock')
+    if fig is not None and resolution is not None: # Intraday bars are not built from quotes
+        update_last_bar(
+            fig, data['07. latest trading day'],
+            close=float(data['05. price']),
+            open=float(data['02. open']),
+            high=float(data['03. high']),
+            low=float(data['04. low']),
+            volume=int(data['06. volume']),
+            resolution=resolution
+        )
+    if fig is not None:
+        show_chart(fig)
 
 @st.dialog("Contact Me")
 def show_contact_form():
@@ -102,10 +199,10 @@ with st.sidebar:
     st.write("eg: MSFT, QQQ, SPY")
     INDICATORS = st.multiselect(
         label="Technical indicators:",
-        options=['SMA', 'EMA']
+        options=available_indicators(['open', 'high', 'low', 'close', 'volume'])
     )
     TIME_SPAN = None
-    if INDICATORS:
+    if "SMA" in INDICATORS or "EMA" in INDICATORS:
         TIME_SPAN = st.slider(
             label="Select time span:",
             min_value=1,  # The minimum permitted value.
@@ -113,6 +210,24 @@ with st.sidebar:
             value=10  # The value of the slider when it first renders.
         )
 
+    INTERVAL = st.selectbox(
+        label="Interval",
+        options=['Daily'] + list(INTRADAY_INTERVALS),
+        index=0
+    )
+
+    RANGE = None
+    if INTERVAL == 'Daily':
+        # Longer ranges are drawn with weekly or monthly bars
+        RANGE = st.select_slider(
+            label="Visible range:",
+            options=list(RANGES),
+            value='1Y'
+        )
+
+    # Quotes polled in the background, the metrics and the last candle redraw on their own
+    LIVE = st.toggle("Live quotes", value=False)
+
 
     st.sidebar.markdown("Made with ❤️ by Leonardo")
 
@@ -135,25 +250,22 @@ col1.header("Global Markets Status")
 
 button = col1.button("Refresh", key="refresh_mkt_status")
 if button:
-    del st.session_state['market_status']
-
-if "market_status" not in st.session_state:
+    market_status.refresh()
 
-    json_data = request_alphavantage(
-        function='MARKET_STATUS',
-        apike=API_KEY
-    ).json()
+# Shared by every session and kept fresh in the background, reading it costs no API call
+json_data, updated = market_status.get()
 
-    st.session_state.market_status = json_data
+if json_data is None:
+    col1.info("Market status is loading, please refresh in a moment.")
+    st.stop()
 
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
+if not is_cacheable(json_data):
+    st.warning(str(ApiNotice(json_data)))
+    st.stop()
 
-    now = datetime.now()
-    col1.write(f'Latest update: {now.strftime("%Y-%m-%d %H:%M")}')
+col1.write(f'Latest update: {updated.strftime("%Y-%m-%d %H:%M")}')
 
-df = pd.DataFrame(st.session_state.market_status['markets']).drop(columns=['notes'])
+df = pd.DataFrame(json_data['markets']).drop(columns=['notes'])
 
 col1.dataframe(
     data=df,
@@ -190,136 +302,154 @@ NAME = json_data['bestMatches'][0]['2. name']
 st.header(f"Stock: {TICKER}")
 st.write(NAME)
 
-button = st.button("Refresh", key="refresh_security")
-if button:
-    fetch_quote_endpoint.clear()
-    fetch_time_series_daily.clear()
-
-#----INFORMATION----
-with st.expander("More info"):
-    if TYPE == "Equity":
-        json_data = fetch_overview(TICKER)
-        data = {
-            'Country': json_data['Country'],
-            'Market Exchange': json_data['Exchange'],
-            'Sector': json_data['Sector'],
-            'Industry': json_data['Industry'],
-            'Market Capitalization': json_data['MarketCapitalization'],
-            'EBITDA': json_data['EBITDA'],
-            'Beta': json_data['Beta']
-        }
-        df = pd.DataFrame([data]).T
-        df.index.name = 'Feature'
-        st.dataframe(
-            data=df.reset_index(),
-            hide_index=True
-        )
-        #st.write(json_data)
-    elif TYPE == "ETF":
-
-        col1, col2, col3 = st.columns([0.3, 0.3, 0.4], gap="small")
-
-        json_data = fetch_etf_profile(TICKER)
-        data = {
-            'Net Assets': json_data['net_assets'],
-            'Net Expense Ratio': json_data['net_expense_ratio'],
-            'Portfolio Turnover ': json_data['portfolio_turnover'],
-            'Dividend Yield': json_data['dividend_yield'],
-            'Inception Date': json_data['inception_date'],
-            'Allocation: Domestic Equities': json_data['asset_allocation']['domestic_equities'],
-            'Allocation: Foreign Equities': json_data['asset_allocation']['foreign_equities'],
-            'Allocation: Bonds': json_data['asset_allocation']['bond'],
-            'Allocation: Cash': json_data['asset_allocation']['cash'],
-            'Allocation: Other': json_data['asset_allocation']['other']
-        }
-        df = pd.DataFrame([data]).T
-        col1.dataframe(
-            data=df.reset_index(),
-            use_container_width=True,
-            hide_index=True
-        )
-        df = pd.DataFrame(json_data['sectors'])
-        col2.dataframe(
-            data=df,
-            hide_index=True
+# Fetches new data in the background, what is cached stays on screen meanwhile
+REFRESH = st.button("Refresh", key="refresh_security")
+
+# Placeholders keep the page layout fixed while the sections fill in
+# in whatever order their data arrives
+info_section = st.expander("More info")
+metrics_section = st.container()
+chart_section = st.container()
+data_section = st.expander("Show data")
+col_prices, col_splits = data_section.columns([0.6, 0.4], gap="medium")
+
+# Once TICKER is resolved these calls are independent, so run them all at once
+calls = {
+    'splits': (fetch_splits_events, TICKER)
+}
+if INTERVAL == 'Daily':
+    calls['daily'] = (fetch_time_series_daily, TICKER, REFRESH)
+else:
+    calls['intraday'] = (fetch_intraday, TICKER, INTERVAL)
+if not LIVE:
+    calls['quote'] = (fetch_quote_endpoint, TICKER, REFRESH) # Live mode has its own
+if TYPE == "Equity":
+    calls['overview'] = (fetch_overview, TICKER)
+elif TYPE == "ETF":
+    calls['etf_profile'] = (fetch_etf_profile, TICKER)
+
+for call, json_data in fetch_concurrently(calls):
+
+    #----INFORMATION----
+    if call == 'overview':
+        with info_section:
+            data = {
+                'Country': json_data['Country'],
+                'Market Exchange': json_data['Exchange'],
+                'Sector': json_data['Sector'],
+                'Industry': json_data['Industry'],
+                'Market Capitalization': json_data['MarketCapitalization'],
+                'EBITDA': json_data['EBITDA'],
+                'Beta': json_data['Beta']
+            }
+            df = pd.DataFrame([data]).T
+            df.index.name = 'Feature'
+            st.dataframe(
+                data=df.reset_index(),
+                hide_index=True
+            )
+            #st.write(json_data)
+
+    elif call == 'etf_profile':
+        with info_section:
+
+            col1, col2, col3 = st.columns([0.3, 0.3, 0.4], gap="small")
+
+            data = {
+                'Net Assets': json_data['net_assets'],
+                'Net Expense Ratio': json_data['net_expense_ratio'],
+                'Portfolio Turnover ': json_data['portfolio_turnover'],
+                'Dividend Yield': json_data['dividend_yield'],
+                'Inception Date': json_data['inception_date'],
+                'Allocation: Domestic Equities': json_data['asset_allocation']['domestic_equities'],
+                'Allocation: Foreign Equities': json_data['asset_allocation']['foreign_equities'],
+                'Allocation: Bonds': json_data['asset_allocation']['bond'],
+                'Allocation: Cash': json_data['asset_allocation']['cash'],
+                'Allocation: Other': json_data['asset_allocation']['other']
+            }
+            df = pd.DataFrame([data]).T
+            col1.dataframe(
+                data=df.reset_index(),
+                use_container_width=True,
+                hide_index=True
+            )
+            df = pd.DataFrame(json_data['sectors'])
+            col2.dataframe(
+                data=df,
+                hide_index=True
+            )
+            #st.write(json_data)
+
+    #----METRICS----
+    elif call == 'quote':
+        with metrics_section:
+
+            json_data, STORED, revalidation = json_data
+            show_quote(json_data['Global Quote'])
+            st.caption(format_age(STORED, refreshing=revalidation is not None))
+
+    #----CANDLESTICK CHART----
+    elif call in ('daily', 'intraday'):
+
+        json_data, STORED, revalidation = json_data
+
+        if call == 'daily':
+            CHART = json_data['Meta Data']['title']
+            SERIES = f'TIME_SERIES_DAILY-{TICKER}'
+            df_dts = pd.DataFrame(json_data['bars'])
+        else:
+            CHART = f'Intraday ({INTERVAL}) prices and volumes'
+            SERIES = f'INTRADAY-{TICKER}-{INTERVAL}'
+            df_dts = pd.DataFrame({'date': json_data['dates'], **json_data['columns']})
+        TITLE = f'{CHART}: {TICKER}'
+
+        # Precomputed for every time span, moving the slider is a lookup
+        if "SMA" in INDICATORS or "EMA" in INDICATORS:
+            averages = moving_averages(SERIES, df_dts['close'].to_numpy())
+        if "SMA" in INDICATORS:
+            df_dts['SMA'] = averages.sma(TIME_SPAN)
+        if "EMA" in INDICATORS:
+            df_dts['EMA'] = averages.ema(TIME_SPAN)
+
+        overlays, panels = indicator_traces(INDICATORS, SERIES, df_dts)
+
+        if call == 'daily':
+            df_dts, overlays, panels = visible_range(df_dts, overlays, panels, RANGE)
+            df_chart, overlays, panels, RESOLUTION = downsample_candles(df_dts, overlays, panels)
+            if RESOLUTION != 'daily':
+                TITLE = f'{TITLE} ({RESOLUTION} bars)'
+        else:
+            # A longer interval shows a longer span, the bars themselves are never merged
+            df_dts, overlays, panels = tail_bars(df_dts, overlays, panels)
+            df_chart, RESOLUTION = df_dts, None
+
+        # Last run's figure, only the indicator traces change when the data did not
+        fig = plot_candles_stick_bar(df_chart, TITLE, TIME_SPAN, overlays, panels, fig=st.session_state.get('fig_stock'))
+        if call == 'intraday':
+            hide_closed_hours(fig)
+        st.session_state['fig_stock'] = fig
+
+        if not LIVE:
+            show_chart(fig, chart_section)
+        chart_section.caption(format_age(STORED, refreshing=revalidation is not None))
+
+        col_prices.markdown("Daily prices" if call == 'daily' else "Intraday prices")
+        col_prices.dataframe(
+            data=df_dts,
+            hide_index=False
         )
-        #st.write(json_data)
-
-#----METRICS----
-
-json_data = fetch_quote_endpoint(TICKER)
-data = json_data['Global Quote']
-PRICE = float(data['05. price'])
-CHANGE = float(data['09. change'])
-CHANGE_PER = float(data['10. change percent'].strip('%'))
-HIGH = float(data['03. high'])
-LOW = float(data['04. low'])
-VOLUME = int(data['06. volume'])
-LATEST_DATE = data['07. latest trading day']
-
-st.metric(
-    "Latest Price",
-    value=f'{PRICE:.1f} USD',
-    delta=f'{CHANGE:.1f} ({CHANGE_PER:.2f}%)'
-    )
-
-
-col1, col2, col3 = st.columns(3, gap="medium")
-
-col1.metric(
-    "High",
-    value=f'{HIGH:.1f} USD'
-    )
-
-col2.metric(
-    "Low",
-    value=f'{LOW:.1f} USD'
-)
 
-col3.metric(
-    "Volume",
-    value=f'{VOLUME}'
-)
+    elif call == 'splits':
 
-st.write("Latest update:", LATEST_DATE)
+        df_splits = json_data
 
-#----CANDLESTICK CHART----
-json_data = fetch_time_series_daily(TICKER)
-
-meta_data = json_data['Meta Data']
-CHART = meta_data['1. Information']
-TITLE = f'{CHART}: {TICKER}'
-
-df_dts = pd.DataFrame(json_data['Time Series (Daily)']).T
-df_dts.columns = [col.split('. ', 1)[1] for col in df_dts.columns]
-df_dts.index.name = 'date'
-df_dts.reset_index(inplace=True)
-
-if "SMA" in INDICATORS:
-    df_dts['SMA'] = df_dts['close'].rolling(window=TIME_SPAN, min_periods=1).mean()
-if "EMA" in INDICATORS:
-    df_dts['EMA'] = df_dts['close'].ewm(span=TIME_SPAN, adjust=False, min_periods=1).mean()
-
-fig = plot_candles_stick_bar(df_dts, TITLE, TIME_SPAN)
-
-st.plotly_chart(fig, use_container_width=True)
-
-with st.expander("Show data"):
-
-    json_data = fetch_splits_events(TICKER)
-    df_splits = pd.DataFrame(json_data['data'])
-
-    col1, col2 = st.columns([0.6, 0.4], gap="medium")
-
-    col1.markdown("Daily prices")
-    col1.dataframe(
-        data=df_dts,
-        hide_index=False
-    )
-
-    col2.markdown("Historical split events")
-    col2.dataframe(
-        data=df_splits,
-        hide_index=True
-    )
+        col_splits.markdown("Historical split events")
+        col_splits.dataframe(
+            data=df_splits,
+            hide_index=True
+        )
 
+#----LIVE QUOTE----
+if LIVE:
+    with metrics_section:
+        live_quote(TICKER, RESOLUTION)
@@ -1,43 +1,129 @@
 import streamlit as st
 import pandas as pd
-from functions import request_alphavantage
+from scheduler import fetch_alphavantage, is_cacheable, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from functions import plot_candles_stick
+from functions import range_start, downsample_candles, RANGES
+from functions import show_chart
+from functions import format_age
+from functions import update_last_bar
+from functions import fetch_concurrently, fetch_or_stop, ApiNotice, bulk_executor
+from bars import bar_store
+from indicators import moving_averages, available_indicators, indicator_traces, TECHNICAL_INDICATORS
+from parsers import to_compact, compact_nbytes
+from memo import memoize
+from cache import MINUTE, HOUR
+from workers import quote_poller, quote_price
+from fx import PIVOT, legs_of, cross_rate, cross_bars, rate_matrix
+
+def fetch_fx_leg_daily(currency):
+    # One stored series per currency, against the pivot
+    return bar_store.update(
+        priority=PRIORITY_NORMAL,
+        function='FX_DAILY',
+        from_symbol=PIVOT,
+        to_symbol=currency
+    )
+
+# One pivot rate, for the live pair and the matrix, which leaves out a failed one
+def fetch_fx_leg(currency, priority=PRIORITY_HIGH):
+    return fetch_alphavantage(
+        priority=priority,
+        function='CURRENCY_EXCHANGE_RATE',
+        from_currency=PIVOT,
+        to_currency=currency
+    )
 
-@st.cache_data
+@memoize(ttl=HOUR)
 def fetch_fx_daily(sym_1, sym_2):
-    json_data = request_alphavantage(
-        function='FX_DAILY',
-        from_symbol=sym_1,
-        to_symbol=sym_2
-    ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
-
-@st.cache_data
+    # Crossed from the pivot series of both currencies
+    calls = {currency: (fetch_fx_leg_daily, currency) for currency in legs_of(sym_1, sym_2)}
+    legs = dict(fetch_concurrently(calls))
+    for json_data in legs.values():
+        if not is_cacheable(json_data):
+            raise ApiNotice(json_data)
+    bars = cross_bars(
+        legs[sym_1]['bars'] if sym_1 in legs else None,
+        legs[sym_2]['bars'] if sym_2 in legs else None
+    )
+    meta_data = dict(next(iter(legs.values()))['Meta Data'], derived=sym_1 != PIVOT)
+    return {'Meta Data': meta_data, **to_compact(bars)}
+
+@memoize(ttl=MINUTE)
 def fetch_fx_now(sym_1, sym_2):
-    json_data = request_alphavantage(
-        function='CURRENCY_EXCHANGE_RATE',
-        from_currency=sym_1,
-        to_currency=sym_2
-    ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
-
-@st.cache_data
+    calls = {currency: (fetch_fx_leg, currency) for currency in legs_of(sym_1, sym_2)}
+    legs = {}
+    for currency, json_data in fetch_concurrently(calls):
+        if quote_price(json_data) is None:
+            raise ApiNotice(json_data)
+        legs[currency] = json_data['Realtime Currency Exchange Rate']
+    return {'Realtime Currency Exchange Rate': cross_rate(sym_1, sym_2, legs)}
+
+@memoize(ttl=HOUR)
 def fetch_fxd_daily(sym_1, sym_2):
-    json_data = request_alphavantage(
+    json_data = bar_store.update(
+        priority=PRIORITY_NORMAL,
         function='DIGITAL_CURRENCY_DAILY',
         symbol=sym_1,
         market=sym_2
-    ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
-    return json_data
+    )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
+    # Only typed arrays are cached, years of bars in a few hundred KB
+    return {'Meta Data': json_data['Meta Data'], **to_compact(json_data['bars'])}
+
+
+def show_rate(data):
+    # Metrics of a CURRENCY_EXCHANGE_RATE
+    EXCHANGE_RATE = float(data['5. Exchange Rate'])
+    BID_PRICE = float(data['8. Bid Price'])
+    ASK_PRICE = float(data['9. Ask Price'])
+    LAST_REFRESHED = data['6. Last Refreshed']
+
+    col1, col2, col3 = st.columns(3, gap="medium")
+
+    col1.metric(
+        "Exchange Rate",
+        value=f'{EXCHANGE_RATE:.4f}'
+        )
+
+    col2.metric(
+        "Bid Price",
+        value=f'{BID_PRICE:.4f}'
+    )
+
+    col3.metric(
+        "Ask Price",
+        value=f'{ASK_PRICE:.4f}'
+    )
+
+    st.write("Latest update:", LAST_REFRESHED)
+    if data.get('derived'):
+        st.caption(f"Derived from the {PIVOT} rates of both currencies")
+
+@st.fragment(run_every=quote_poller.interval())
+def live_rate(sym_1, sym_2, resolution):
+    # Crossed from the polled pivot legs, shared by every pair that needs them
+    legs = {}
+    ages = []
+    polled = []
+    for currency in legs_of(sym_1, sym_2):
+        json_data, updated, ring = quote_poller.watch(function='CURRENCY_EXCHANGE_RATE', from_currency=PIVOT, to_currency=currency)
+        if quote_price(json_data) is None:
+            st.warning(str(ApiNotice(json_data)) if not is_cacheable(json_data) else 'No exchange rate available yet.')
+            return
+        legs[currency] = json_data['Realtime Currency Exchange Rate']
+        ages.append(updated)
+        polled.append(ring.count)
+
+    data = cross_rate(sym_1, sym_2, legs)
+    show_rate(data)
+    st.caption(f"Live: {format_age(min(ages))}, {min(polled)} rates polled")
+
+    fig = st.session_state.get('fig_fx')
+    if fig is not None:
+        # The bar of the rate's day, in UTC like the daily series
+        update_last_bar(fig, data['6. Last Refreshed'][:10], close=float(data['5. Exchange Rate']), resolution=resolution)
+        show_chart(fig)
 
 
 st.set_page_config(
@@ -85,6 +171,9 @@ with st.sidebar:
 
     st.write(CURRENCY_1)
 
+    # Every currency of the matrix, before the base is taken out of the counter list
+    MATRIX_CURRENCIES = list(dict.fromkeys([*currencies_1.values(), *currencies_2.values()]))
+
     if option1 in currencies_2:
         currencies_2.pop(option1)
 
@@ -99,12 +188,13 @@ with st.sidebar:
 
     st.write(currencies_2[option2])
 
+    # FX series carry no volume, so VWAP is left out
     INDICATORS = st.multiselect(
         label="Technical indicators:",
-        options=['SMA', 'EMA']
+        options=available_indicators(['open', 'high', 'low', 'close'])
     )
     TIME_SPAN = None
-    if INDICATORS:
+    if "SMA" in INDICATORS or "EMA" in INDICATORS:
         TIME_SPAN = st.slider(
             label="Select time span:",
             min_value=1,  # The minimum permitted value.
@@ -112,63 +202,106 @@ with st.sidebar:
             value=10  # The value of the slider when it first renders.
         )
 
-    st.sidebar.markdown("Made with ❤️ by Leonardo")
-
-
-# ---- MAINPAGE ----
-
-st.title("Forex Market")
+    # Longer ranges are drawn with weekly or monthly bars
+    RANGE = st.select_slider(
+        label="Visible range:",
+        options=list(RANGES),
+        value='1Y'
+    )
 
-col1, col2, col3 = st.columns(3, gap="medium")
+    # Rates polled in the background, the metrics and the last candle redraw on their own
+    LIVE = st.toggle("Live rates", value=False)
 
-json_data = fetch_fx_now(CURRENCY_1, CURRENCY_2)
+    # Every pair from one pivot rate per currency
+    MATRIX = st.toggle("Currency matrix", value=False)
 
+    st.sidebar.markdown("Made with ❤️ by Leonardo")
 
-EXCHANGE_RATE = float(json_data['Realtime Currency Exchange Rate']['5. Exchange Rate'])
-BID_PRICE = float(json_data['Realtime Currency Exchange Rate']['8. Bid Price'])
-ASK_PRICE = float(json_data['Realtime Currency Exchange Rate']['9. Ask Price'])
-LAST_REFRESHED = json_data['Realtime Currency Exchange Rate']['6. Last Refreshed']
 
-col1.metric(
-    "Exchange Rate",
-    value=f'{EXCHANGE_RATE:.4f}'
-    )
+# ---- MAINPAGE ----
 
-col2.metric(
-    "Bid Price",
-    value=f'{BID_PRICE:.4f}'
-)
+st.title("Forex Market")
 
-col3.metric(
-    "Ask Price",
-    value=f'{ASK_PRICE:.4f}'
-)
+# Metrics on top, and in live mode the chart too
+live_section = st.container()
 
-st.write("Latest update:", LAST_REFRESHED)
+if not LIVE:
+    with live_section:
+        show_rate(fetch_or_stop(fetch_fx_now, CURRENCY_1, CURRENCY_2)['Realtime Currency Exchange Rate'])
 
 if CURRENCY_1 in ["BTC", "ETH", "USDT"]:
-    json_data = fetch_fxd_daily(CURRENCY_1, CURRENCY_2)
-    df = pd.DataFrame(json_data['Time Series (Digital Currency Daily)']).T[:100]
+    json_data = fetch_or_stop(fetch_fxd_daily, CURRENCY_1, CURRENCY_2)
 else:
-    json_data = fetch_fx_daily(CURRENCY_1, CURRENCY_2)
-    df = pd.DataFrame(json_data['Time Series FX (Daily)']).T
+    json_data = fetch_or_stop(fetch_fx_daily, CURRENCY_1, CURRENCY_2)
+
+dates = json_data['dates'].view('datetime64[D]') # No copy
+columns = {name: json_data['columns'][name] for name in ('open', 'high', 'low', 'close')}
 
 meta_data = json_data['Meta Data']
-CHART = meta_data['1. Information']
+CHART = meta_data['title']
 TITLE = f'{CHART}: {CURRENCY_1}/{CURRENCY_2}'
+SERIES = f'{CHART}-{CURRENCY_1}-{CURRENCY_2}'
 
-df.columns = [col.split('. ', 1)[1] for col in df.columns]
-df.index.name = 'date'
-df.reset_index(inplace=True)
+# Only the bars in range make it into the frame
+start = range_start(dates, RANGE)
+df = pd.DataFrame({'date': dates[start:], **{name: values[start:] for name, values in columns.items()}})
 
+# Indicators still see the whole history, so the first bars shown are not cut short
+if "SMA" in INDICATORS or "EMA" in INDICATORS:
+    averages = moving_averages(SERIES, columns['close'])
 if "SMA" in INDICATORS:
-    df['SMA'] = df['close'].rolling(window=TIME_SPAN, min_periods=1).mean()
+    df['SMA'] = averages.sma(TIME_SPAN)[start:]
 if "EMA" in INDICATORS:
-    df['EMA'] = df['close'].ewm(span=TIME_SPAN, adjust=False, min_periods=1).mean()
+    df['EMA'] = averages.ema(TIME_SPAN)[start:]
 
-fig = plot_candles_stick(df, TITLE, TIME_SPAN)
+overlays, panels = {}, {}
+if any(name in TECHNICAL_INDICATORS for name in INDICATORS):
+    history = pd.DataFrame({'date': dates, **columns})
+    overlays, panels = indicator_traces(INDICATORS, SERIES, history, last=len(df))
 
-st.plotly_chart(fig, use_container_width=True)
+df_chart, overlays, panels, RESOLUTION = downsample_candles(df, overlays, panels)
+if RESOLUTION != 'daily':
+    TITLE = f'{TITLE} ({RESOLUTION} bars)'
+
+# Last run's figure, only the indicator traces change when the data did not
+fig = plot_candles_stick(df_chart, TITLE, TIME_SPAN, overlays, panels, fig=st.session_state.get('fig_fx'))
+st.session_state['fig_fx'] = fig
+
+if LIVE:
+    with live_section:
+        live_rate(CURRENCY_1, CURRENCY_2, RESOLUTION)
+else:
+    show_chart(fig)
+
+st.caption(f"{len(dates)} daily bars cached for this pair, {compact_nbytes(json_data) / 1e3:.0f} KB")
 
 with st.expander("Show data"):
-    st.dataframe(df)
\ No newline at end of file
+    st.dataframe(df)
+
+#----CURRENCY MATRIX----
+if MATRIX:
+
+    st.subheader("Currency matrix")
+
+    # Every leg through the bulk pool at low priority, behind other pages' first paint
+    calls = {currency: (fetch_fx_leg, currency, PRIORITY_LOW) for currency in legs_of(*MATRIX_CURRENCIES)}
+    rates = {PIVOT: 1.0}
+    missing = []
+    with st.spinner(f"Loading {len(calls)} {PIVOT} rates..."):
+        for currency, json_data in fetch_concurrently(calls, bulk_executor):
+            if quote_price(json_data) is None:
+                missing.append(currency)
+            else:
+                rates[currency] = quote_price(json_data)
+
+    if missing:
+        st.warning(f"Not available right now: {', '.join(c for c in MATRIX_CURRENCIES if c in missing)}")
+
+    # Same order as the sidebar
+    matrix = rate_matrix({currency: rates[currency] for currency in MATRIX_CURRENCIES if currency in rates})
+    st.dataframe(
+        data=matrix.style.format('{:.6g}'),
+        use_container_width=True
+    )
+    st.caption(f"Base currency down, counter across. {len(matrix) * (len(matrix) - 1)} rates from {len(rates) - 1} calls, "
+               f"every rate outside the {PIVOT} row is derived.")
@@ -1,19 +1,70 @@
+import numpy as np
 import streamlit as st
 import pandas as pd
-from functions import request_alphavantage
+from scheduler import is_cacheable, PRIORITY_NORMAL, PRIORITY_LOW
 from functions import plot_line_chart
-
-@st.cache_data
-def fetch_commodity(comm, interval="monthly"):
-    json_data = request_alphavantage(
+from functions import downsample_line
+from functions import resample_values, INTERVALS
+from functions import show_chart
+from functions import plot_comparison_chart, plot_correlation_heatmap
+from functions import fetch_concurrently, fetch_or_stop, ApiNotice, bulk_executor
+from bars import bar_store, commodity_interval
+from watchlist import COMMODITIES
+from indicators import moving_averages, available_indicators, indicator_traces
+from memo import memoize
+from cache import DAY
+
+# Bars of one period, per interval: a year of them for the volatility
+PERIODS_PER_YEAR = {'daily': 252, 'weekly': 52, 'monthly': 12, 'quarterly': 4, 'annual': 1}
+# Slider range and starting value, per interval
+PERIOD_LIMITS = {'daily': (2500, 250), 'weekly': (520, 104), 'monthly': (240, 24), 'quarterly': (80, 20), 'annual': (40, 20)}
+PERIOD_NAMES = {'daily': 'days', 'weekly': 'weeks', 'monthly': 'months', 'quarterly': 'quarters', 'annual': 'years'}
+
+def fetch_commodity(comm):
+    # One series per commodity, at the finest interval the API has for it.
+    # Not memoized: the bar store maps it from disk, only what is derived from it is kept.
+    json_data = bar_store.update(
+        priority=PRIORITY_NORMAL,
         function=comm,
-        interval=interval
-    ).json()
-    if "Information" in json_data:
-        st.warning(json_data['Information'])
-        st.stop()
+        interval=commodity_interval(comm)
+    )
+    if not is_cacheable(json_data):
+        raise ApiNotice(json_data)
     return json_data
 
+@memoize(ttl=DAY)
+def resample_commodity(comm, interval):
+    # Coarser intervals averaged locally, rather than fetched on their own
+    json_data = fetch_commodity(comm)
+    bars = json_data['bars']
+    dates, values = resample_values(bars['date'], bars['value'], interval)
+    return {'Meta Data': json_data['Meta Data'], 'date': dates, 'value': values}
+
+# One panel series, the panel leaves out a commodity that failed
+def fetch_panel_series(comm):
+    return bar_store.update(
+        priority=PRIORITY_LOW,
+        function=comm,
+        interval=commodity_interval(comm)
+    )
+
+@memoize(ttl=DAY)
+def commodity_panel(series, interval):
+    # series maps a name to its stored bars. One column per commodity on
+    # their common dates, rebuilt only when some series got new bars.
+    columns = {}
+    for name, bars in series.items():
+        dates, values = resample_values(bars['date'], bars['value'], interval)
+        columns[name] = pd.Series(values, index=pd.DatetimeIndex(dates, name='date'))
+    return pd.DataFrame(columns).sort_index()
+
+@memoize(ttl=DAY)
+def return_correlations(panel, periods):
+    # Correlation of the period log returns over the last periods
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.log(panel.iloc[-periods - 1:]).diff()
+    return returns.corr(min_periods=3)
+
 
 st.set_page_config(
     page_title="Commodities", # The page title, shown in the browser tab.
@@ -27,18 +78,7 @@ st.set_page_config(
 
 # ---- SIDEBAR ----
 with st.sidebar:
-    commodities = {
-        'West Texas Intermediate': 'WTI',
-        'Brent': 'BRENT',
-        'Natural Gas': 'NATURAL_GAS',
-        'Copper': 'COPPER',
-        'Aluminum': 'ALUMINUM',
-        'Wheat': 'WHEAT',
-        'Corn': 'CORN',
-        'Cotton': 'COTTON',
-        'Sugar': 'SUGAR',
-        'Coffee': 'COFFEE'
-    }
+    commodities = COMMODITIES
 
     option = st.selectbox(
         label="Commodity",
@@ -51,19 +91,29 @@ with st.sidebar:
 
     st.write(COMMODITY)
 
+    # Every interval from the stored one up
+    intervals = INTERVALS[INTERVALS.index(commodity_interval(COMMODITY)):]
+    INTERVAL = st.selectbox(
+        label="Interval",
+        options=intervals,
+        index=intervals.index('monthly')
+    )
+
     PERIODS = st.slider(
-        label="Select number of months:",
+        label=f"Select number of {PERIOD_NAMES[INTERVAL]}:",
         min_value=1,  # The minimum permitted value.
-        max_value=100,  # The maximum permitted value.
-        value=24  # The value of the slider when it first renders.
+        max_value=PERIOD_LIMITS[INTERVAL][0],  # The maximum permitted value.
+        value=PERIOD_LIMITS[INTERVAL][1],  # The value of the slider when it first renders.
+        key=f'periods_{INTERVAL}' # Each interval keeps its own count
     )
 
+    # Only a single value per period, so just the close based indicators
     INDICATORS = st.multiselect(
         label="Technical indicators:",
-        options=['SMA', 'EMA']
+        options=available_indicators(['close'])
     )
     TIME_SPAN = None
-    if INDICATORS:
+    if "SMA" in INDICATORS or "EMA" in INDICATORS:
         TIME_SPAN = st.slider(
             label="Select time span:",
             min_value=1,  # The minimum permitted value.
@@ -71,6 +121,11 @@ with st.sidebar:
             value=10  # The value of the slider when it first renders.
         )
 
+    COMPARE = st.toggle(
+        label="Compare all commodities",
+        value=False
+    )
+
     st.sidebar.markdown("Made with ❤️ by Leonardo")
 
 
@@ -78,24 +133,84 @@ with st.sidebar:
 
 st.title("Commodity Market")
 
-json_data = fetch_commodity(COMMODITY)
-data = json_data['data']
+series = fetch_or_stop(resample_commodity, COMMODITY, INTERVAL)
+SERIES = f'{COMMODITY}-{INTERVAL}'
 
-st.write("Latest month:", data[0]['date'])
+st.write("Latest:", str(series['date'][-1]))
 
-df = pd.DataFrame(data)[:PERIODS]
+# Only the periods shown make it into the frame
+df = pd.DataFrame({'date': series['date'][-PERIODS:], 'value': series['value'][-PERIODS:]})
 
-CHART = json_data['name']
-TITLE = f'{CHART}'
+CHART = series['Meta Data']['title']
+TITLE = f'{CHART} ({INTERVAL})'
 
+# Computed over the whole history, so the first periods shown are not cut short
+if "SMA" in INDICATORS or "EMA" in INDICATORS:
+    averages = moving_averages(SERIES, series['value'])
 if "SMA" in INDICATORS:
-    df['SMA'] = df['value'].rolling(window=TIME_SPAN, min_periods=1).mean()
+    df['SMA'] = averages.sma(TIME_SPAN)[-PERIODS:]
 if "EMA" in INDICATORS:
-    df['EMA'] = df['value'].ewm(span=TIME_SPAN, adjust=False, min_periods=1).mean()
+    df['EMA'] = averages.ema(TIME_SPAN)[-PERIODS:]
+
+overlays, panels = indicator_traces(
+    INDICATORS, SERIES, pd.DataFrame({'date': series['date'], 'value': series['value']}, copy=False),
+    price='value', last=PERIODS,
+    # A standard deviation needs two returns at least, annual bars would give one
+    params={'Volatility': {'window': max(min(PERIODS_PER_YEAR[INTERVAL], 20), 2), 'periods_per_year': PERIODS_PER_YEAR[INTERVAL]}}
+)
+
+# At most one point per pixel, whatever the interval and number of periods
+df_chart, overlays, panels = downsample_line(df, overlays, panels)
 
-fig = plot_line_chart(df, TITLE, TIME_SPAN)
+fig = plot_line_chart(df_chart, TITLE, TIME_SPAN, overlays, panels, fig=st.session_state.get('fig_commodity'))
+st.session_state['fig_commodity'] = fig
 
-st.plotly_chart(fig, use_container_width=True)
+show_chart(fig)
 
 with st.expander("Show data"):
-    st.dataframe(df)
\ No newline at end of file
+    st.dataframe(df)
+
+#----ALL COMMODITIES----
+if COMPARE:
+
+    st.subheader("All commodities")
+
+    # Monthly and slower are the intervals every commodity has
+    PANEL_INTERVAL = INTERVAL if INTERVAL in ('monthly', 'quarterly', 'annual') else 'monthly'
+    PANEL_PERIODS = PERIODS if PANEL_INTERVAL == INTERVAL else PERIOD_LIMITS['monthly'][1]
+
+    # Every series through the bulk pool, behind other pages' first paint.
+    # The scheduler keeps them within the rate limit.
+    calls = {name: (fetch_panel_series, comm) for name, comm in commodities.items()}
+    series = {}
+    missing = []
+    with st.spinner(f"Loading {len(calls)} commodities..."):
+        for name, json_data in fetch_concurrently(calls, bulk_executor):
+            if 'bars' in json_data:
+                series[name] = json_data['bars']
+            else:
+                missing.append(name)
+
+    if missing:
+        st.warning(f"Not available right now: {', '.join(n for n in commodities if n in missing)}")
+
+    if series:
+        panel = commodity_panel({name: series[name] for name in commodities if name in series}, PANEL_INTERVAL)
+        shown = panel.iloc[-PANEL_PERIODS:]
+
+        # Each normalized to its first value shown, so every line starts at 0%
+        changes = {}
+        for name in shown.columns:
+            values = shown[name].dropna()
+            if len(values):
+                changes[name] = pd.DataFrame({'date': values.index, 'change': (values / values.iloc[0] - 1) * 100})
+
+        fig = plot_comparison_chart(changes, f'Change over the last {PANEL_PERIODS} {PERIOD_NAMES[PANEL_INTERVAL]}')
+        show_chart(fig)
+
+        corr = return_correlations(panel, PANEL_PERIODS)
+        fig = plot_correlation_heatmap(corr, f'Correlation of {PANEL_INTERVAL} returns, last {PANEL_PERIODS} {PERIOD_NAMES[PANEL_INTERVAL]}')
+        show_chart(fig)
+
+        with st.expander("Show panel"):
+            st.dataframe(shown)
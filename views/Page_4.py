@@ -0,0 +1,158 @@
+import re
+import time
+import streamlit as st
+import pandas as pd
+from scheduler import fetch_alphavantage, is_cacheable, PRIORITY_NORMAL, PRIORITY_LOW
+from functions import plot_comparison_chart
+from functions import visible_range, RANGES
+from functions import fetch_concurrently, bulk_executor
+from functions import show_chart
+from bars import bar_store
+from watchlist import TICKERS
+from indicators import performance
+
+MAX_SYMBOLS = 100
+
+# A symbol whose quote or series failed is listed as missing. Bulk loads
+# queue behind other pages' first paint: quotes at normal priority, series at low.
+def fetch_quote(ticker):
+    return fetch_alphavantage(
+        priority=PRIORITY_NORMAL,
+        function='GLOBAL_QUOTE',
+        symbol=ticker
+    )
+
+def fetch_daily(ticker):
+    # Same params as the Stock page, so both share one series per symbol
+    return bar_store.update(
+        priority=PRIORITY_LOW,
+        function='TIME_SERIES_DAILY',
+        symbol=ticker,
+        datatype='json'
+    )
+
+
+st.set_page_config(
+    page_title="Watchlist", # The page title, shown in the browser tab.
+    page_icon=":eyes:", # The page favicon.
+    layout="wide", # How the page content should be laid out.
+    initial_sidebar_state="auto", # How the sidebar should start out.
+    menu_items={ # Configure the menu that appears on the top-right side of this app.
+        "Get help": "https://github.com/LMAPcoder" # The URL this menu item should point to.
+    }
+)
+
+
+# ---- SIDEBAR ----
+with st.sidebar:
+
+    SYMBOLS = st.text_area(
+        label="Symbols",
+        value=", ".join(TICKERS),
+        placeholder="Input tickers separated by commas or spaces"
+    )
+    st.write("eg: MSFT, QQQ, SPY")
+
+    RANGE = st.select_slider(
+        label="Visible range:",
+        options=list(RANGES),
+        value='1Y'
+    )
+
+    st.sidebar.markdown("Made with ❤️ by Leonardo")
+
+
+# ---- MAINPAGE ----
+
+st.title("Watchlist")
+
+# Upper case, in the order typed, each once
+TICKERS = list(dict.fromkeys(s for s in re.split(r'[\s,;]+', SYMBOLS.upper()) if s))
+
+if not TICKERS:
+    st.info("Input at least one ticker.")
+    st.stop()
+
+if len(TICKERS) > MAX_SYMBOLS:
+    st.warning(f"Only the first {MAX_SYMBOLS} symbols are shown.")
+    TICKERS = TICKERS[:MAX_SYMBOLS]
+
+chart_section = st.container()
+table_section = st.container()
+
+# Every quote and series, through the bulk pool: cached ones come back right
+# away, the others queue in the scheduler within the rate limit
+calls = {}
+for ticker in TICKERS:
+    calls[('quote', ticker)] = (fetch_quote, ticker)
+    calls[('daily', ticker)] = (fetch_daily, ticker)
+
+progress = st.progress(0.0, text=f"Loading {len(TICKERS)} symbols...")
+start = time.time()
+quotes = {}
+series = {}
+missing = set()
+
+for done, ((call, ticker), json_data) in enumerate(fetch_concurrently(calls, bulk_executor), 1):
+    progress.progress(done / len(calls), text=f"Loading {len(TICKERS)} symbols... {ticker}")
+
+    if not is_cacheable(json_data):
+        missing.add(ticker)
+
+    elif call == 'quote':
+        if json_data.get('Global Quote'):
+            quotes[ticker] = json_data['Global Quote']
+
+    elif call == 'daily':
+        df = pd.DataFrame(json_data['bars'][['date', 'close', 'volume']])
+        df, _, _ = visible_range(df, {}, {}, RANGE)
+        if len(df):
+            series[ticker] = df
+
+progress.empty()
+
+if missing:
+    st.warning(f"Not available right now: {', '.join(t for t in TICKERS if t in missing)}")
+
+#----COMPARISON CHART----
+# Normalized to the first bar shown, so every symbol starts at 0%
+changes = {
+    ticker: pd.DataFrame({'date': df['date'], 'change': (df['close'] / df['close'].iloc[0] - 1) * 100})
+    for ticker, df in ((t, series[t]) for t in TICKERS if t in series)
+}
+
+with chart_section:
+    fig = plot_comparison_chart(changes, f'Change over {RANGE}')
+    show_chart(fig)
+    st.caption(f"{len(series)} of {len(TICKERS)} symbols loaded in {time.time() - start:.1f} s")
+
+#----METRICS TABLE----
+rows = []
+for ticker in TICKERS:
+    quote = quotes.get(ticker, {})
+    df = series.get(ticker)
+    row = {
+        'Symbol': ticker,
+        'Price': float(quote['05. price']) if quote else None,
+        'Change %': float(quote['10. change percent'].strip('%')) if quote else None,
+    }
+    if df is not None:
+        row.update(performance(df['close'].to_numpy()))
+        row['Avg volume'] = df['volume'].mean()
+    rows.append(row)
+
+with table_section:
+    # Click a column header to sort by it
+    st.dataframe(
+        data=pd.DataFrame(rows).sort_values('Return %', ascending=False) if series else pd.DataFrame(rows),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            'Price': st.column_config.NumberColumn(format='%.2f'),
+            'Change %': st.column_config.NumberColumn(format='%.2f%%'),
+            'Return %': st.column_config.NumberColumn(f'Return {RANGE} %', format='%.2f%%'),
+            'Volatility %': st.column_config.NumberColumn(format='%.1f%%'),
+            'Max drawdown %': st.column_config.NumberColumn(format='%.1f%%'),
+            'Avg volume': st.column_config.NumberColumn(format='%d'),
+        }
+    )
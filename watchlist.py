@@ -0,0 +1,20 @@
+# Kept warm in the background (see workers.Prefetcher), so the first visitor
+# of these pages does not pay the cold latency of every fetch
+
+TICKERS = ['MSFT', 'QQQ', 'SPY']
+
+# (from, to) pairs shown on the Forex page
+FX_PAIRS = [('USD', 'EUR'), ('EUR', 'USD'), ('USD', 'JPY'), ('GBP', 'USD')]
+
+COMMODITIES = {
+    'West Texas Intermediate': 'WTI',
+    'Brent': 'BRENT',
+    'Natural Gas': 'NATURAL_GAS',
+    'Copper': 'COPPER',
+    'Aluminum': 'ALUMINUM',
+    'Wheat': 'WHEAT',
+    'Corn': 'CORN',
+    'Cotton': 'COTTON',
+    'Sugar': 'SUGAR',
+    'Coffee': 'COFFEE'
+}
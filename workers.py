@@ -0,0 +1,309 @@
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
+from functions import is_market_open, MARKET_OPEN, MARKET_CLOSE
+from scheduler import scheduler, fetch_alphavantage, cache_key, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from cache import response_cache, DAY
+from bars import bar_store, commodity_interval
+from symbols import symbol_index
+from fx import PIVOT, legs_of
+from watchlist import TICKERS, FX_PAIRS, COMMODITIES
+
+MARKET_STATUS_SHARE = 0.1 # Part of the daily quota background status refreshes may use
+MARKET_STATUS_MIN_INTERVAL = 15 * 60 # Seconds, however large the quota
+
+PREFETCH_INTERVAL_OPEN = 5 * 60 # Seconds between two warm-up passes while the market is open
+PREFETCH_INTERVAL_CLOSED = 30 * 60
+PREFETCH_SHARE = 0.2 # Part of the daily quota the prefetcher may spend
+# Quota always left to interactive users, background work never dips below it
+RESERVE_PER_MINUTE = 2
+RESERVE_PER_DAY = 10
+
+QUOTE_SHARE = 0.2 # Part of the daily quota live quotes may use, split between the watched ones
+QUOTE_MIN_INTERVAL = 60 # Seconds between two polls of a quote at least, its cache lifetime
+QUOTE_WATCH_TIMEOUT = 5 * 60 # A quote no page has read for this long (or two intervals) stops being polled
+QUOTE_TICKS = 512 # Polled quotes kept per symbol
+
+
+def has_spare_quota():
+    # Whether background work may make a call now, without touching the reserve
+    quota = scheduler.quota()
+    return quota['day'] > RESERVE_PER_DAY and quota['minute'] > RESERVE_PER_MINUTE
+
+
+class MarketStatus:
+    # Process-wide MARKET_STATUS snapshot. One background thread refreshes it,
+    # readers only ever look at the last snapshot. It covers markets around
+    # the clock, so refreshes are spread evenly over the day, MARKET_STATUS_SHARE
+    # of the day's quota out of spare quota only.
+
+    def __init__(self, share=MARKET_STATUS_SHARE):
+        self.share = share
+        self.json_data = None
+        self.updated = None
+        self._rounds = 0 # Refreshes done, a cached answer included
+        self._wake = threading.Event()
+        self._changed = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='market-status', daemon=True)
+                self._thread.start()
+
+    def get(self, timeout=10):
+        # Returns (json_data, updated), waiting for the first snapshot if there is none yet
+        self.start()
+        with self._changed:
+            self._changed.wait_for(lambda: self.json_data is not None, timeout)
+            return self.json_data, self.updated
+
+    def refresh(self, timeout=5):
+        # Asks the worker for a new snapshot and waits a little for it
+        self.start()
+        with self._changed:
+            seen = self._rounds
+            self._wake.set()
+            self._changed.wait_for(lambda: self._rounds != seen, timeout)
+
+    def interval(self):
+        # Seconds between two refreshes, the calls the share allows over 24 hours
+        calls = max(int(scheduler.per_day * self.share), 1)
+        return max(DAY / calls, MARKET_STATUS_MIN_INTERVAL)
+
+    def _loop(self):
+        while True:
+            # A reader waiting on refresh() or on the first snapshot may dip into the reserve
+            asked = self._wake.is_set() or self.json_data is None
+            self._wake.clear()
+
+            if asked or has_spare_quota():
+                # Through the disk cache, a restart reuses the last snapshot while it is fresh
+                json_data = fetch_alphavantage(PRIORITY_NORMAL if asked else PRIORITY_LOW, function='MARKET_STATUS')
+
+                with self._changed:
+                    if 'markets' in json_data:
+                        entry = response_cache.get_entry(cache_key({'function': 'MARKET_STATUS'}))
+                        self.json_data = json_data
+                        self.updated = datetime.fromtimestamp(entry[1]) if entry else datetime.now()
+                    elif self.json_data is None or 'markets' not in self.json_data:
+                        self.json_data = json_data # Nothing better to show than the notice
+                    self._rounds += 1
+                    self._changed.notify_all()
+
+            self._wake.wait(self.interval())
+
+
+market_status = MarketStatus()
+
+
+class Prefetcher:
+    # Warms the disk cache and the bar store for the watchlist, with the lowest
+    # priority and only out of spare quota. Quotes only move while the market is
+    # open, daily series expire at the close, so a pass outside market hours
+    # mostly costs nothing.
+
+    def __init__(self, tickers=TICKERS, fx_pairs=FX_PAIRS, commodities=COMMODITIES):
+        self.tickers = tickers
+        # The Forex page crosses every pair from the pivot rates of its currencies
+        self.fx_legs = legs_of(*(currency for pair in fx_pairs for currency in pair))
+        self.commodities = list(commodities.values())
+        self.warmed = 0
+        self.errors = 0
+        self.last_pass = None
+        self.spent = 0 # Calls of the day's quota gone while a job ran
+        self.day = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='prefetch', daemon=True)
+                self._thread.start()
+
+    def jobs(self, quotes=True):
+        # Same params as the pages use, so the pages find them in the cache.
+        # Most visible first, in case the quota runs out half way. The listing
+        # is one call a week for the whole US listing, searches are then
+        # answered locally instead of costing a call each.
+        yield lambda: symbol_index.refresh(PRIORITY_LOW)
+
+        if quotes:
+            for ticker in self.tickers:
+                yield lambda ticker=ticker: fetch_alphavantage(PRIORITY_LOW, function='GLOBAL_QUOTE', symbol=ticker)
+            for currency in self.fx_legs:
+                yield lambda currency=currency: fetch_alphavantage(PRIORITY_LOW, function='CURRENCY_EXCHANGE_RATE', from_currency=PIVOT, to_currency=currency)
+
+        for ticker in self.tickers:
+            yield lambda ticker=ticker: bar_store.update(PRIORITY_LOW, function='TIME_SERIES_DAILY', symbol=ticker, datatype='json')
+        for currency in self.fx_legs:
+            yield lambda currency=currency: bar_store.update(PRIORITY_LOW, function='FX_DAILY', from_symbol=PIVOT, to_symbol=currency)
+        for comm in self.commodities:
+            yield lambda comm=comm: bar_store.update(PRIORITY_LOW, function=comm, interval=commodity_interval(comm))
+        for ticker in self.tickers:
+            yield lambda ticker=ticker: fetch_alphavantage(PRIORITY_LOW, function='SPLITS', symbol=ticker)
+
+    def budget(self):
+        # Calls a day the prefetcher may spend, PREFETCH_SHARE of the quota
+        return int(scheduler.per_day * PREFETCH_SHARE)
+
+    def warms_quotes(self):
+        # Quotes are only worth warming when the budget covers every pass of
+        # a session, a few warm quotes would just eat the day's calls
+        session = datetime.combine(datetime.min, MARKET_CLOSE) - datetime.combine(datetime.min, MARKET_OPEN)
+        passes = session.total_seconds() / PREFETCH_INTERVAL_OPEN
+        return (len(self.tickers) + len(self.fx_legs)) * passes <= self.budget()
+
+    def _has_budget(self):
+        # Waits out a busy minute, gives up on the pass once the prefetcher
+        # spent its share or the day is nearly spent
+        today = datetime.now(timezone.utc).date() # The scheduler's day
+        if today != self.day:
+            self.day = today
+            self.spent = 0
+        while True:
+            quota = scheduler.quota()
+            if quota['day'] <= RESERVE_PER_DAY or self.spent >= self.budget():
+                return False
+            if quota['minute'] > RESERVE_PER_MINUTE:
+                return True
+            time.sleep(5)
+
+    def run_pass(self, quotes=True):
+        for job in self.jobs(quotes):
+            if not self._has_budget():
+                break
+            # Cache hits cost nothing; other sessions' calls in the meantime
+            # count too, which only errs on the side of the users
+            left = scheduler.quota()['day']
+            try:
+                job()
+                self.warmed += 1
+            except Exception:
+                self.errors += 1
+            self.spent += max(left - scheduler.quota()['day'], 0)
+        self.last_pass = datetime.now()
+
+    def _loop(self):
+        first = True
+        while True:
+            market_open = is_market_open()
+            # Quotes are warmed during the session, and once at start-up,
+            # when the quota is large enough for it
+            self.run_pass(quotes=(market_open or first) and self.warms_quotes())
+            first = False
+            time.sleep(PREFETCH_INTERVAL_OPEN if market_open else PREFETCH_INTERVAL_CLOSED)
+
+
+prefetcher = Prefetcher()
+
+
+def quote_price(json_data):
+    # Last price of a GLOBAL_QUOTE or CURRENCY_EXCHANGE_RATE answer, None for a notice
+    if 'Global Quote' in json_data and json_data['Global Quote']:
+        return float(json_data['Global Quote']['05. price'])
+    if 'Realtime Currency Exchange Rate' in json_data:
+        return float(json_data['Realtime Currency Exchange Rate']['5. Exchange Rate'])
+    return None
+
+
+class QuoteRing:
+    # The last quotes of one symbol, oldest overwritten first
+
+    def __init__(self, size=QUOTE_TICKS):
+        self.times = np.zeros(size)
+        self.prices = np.zeros(size)
+        self.count = 0
+
+    def append(self, when, price):
+        i = self.count % len(self.times)
+        self.times[i] = when
+        self.prices[i] = price
+        self.count += 1
+
+    def last(self, n=QUOTE_TICKS):
+        # (times, prices) copies, oldest first
+        n = min(n, self.count, len(self.times))
+        idx = (np.arange(self.count - n, self.count)) % len(self.times)
+        return self.times[idx], self.prices[idx]
+
+
+class QuotePoller:
+    # Live quotes for the symbols pages are watching. One background thread
+    # polls them in turn, QUOTE_SHARE of the day's quota spread over the day,
+    # out of spare quota only, and keeps the last answer and a ring of prices.
+    # Pages redraw their live section from those in a fragment, which reads
+    # memory only and leaves the rest of the page alone.
+
+    def __init__(self, share=QUOTE_SHARE):
+        self.share = share
+        self._watched = {} # key -> dict(params, seen, polled, json_data, updated, ring)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='quote-poller', daemon=True)
+                self._thread.start()
+
+    def watch(self, **params):
+        # Returns (json_data, updated, ring) for a GLOBAL_QUOTE or
+        # CURRENCY_EXCHANGE_RATE call, and keeps it polled while pages ask for it
+        self.start()
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            entry = self._watched.get(key)
+            if entry is None:
+                entry = self._watched[key] = {
+                    'params': params, 'seen': 0, 'polled': 0,
+                    'json_data': None, 'updated': None, 'ring': QuoteRing()
+                }
+            entry['seen'] = time.time()
+
+        if entry['json_data'] is None:
+            self._poll(entry, PRIORITY_HIGH) # Someone is waiting for this one
+        return entry['json_data'], entry['updated'], entry['ring']
+
+    def interval(self):
+        # Seconds between two polls of one quote, the longer the more are watched.
+        # Pages redraw their live section at the same pace.
+        calls = max(scheduler.per_day * self.share, 1)
+        return max(DAY * max(len(self._watched), 1) / calls, QUOTE_MIN_INTERVAL)
+
+    def _poll(self, entry, priority=PRIORITY_NORMAL):
+        entry['polled'] = time.time()
+        json_data = fetch_alphavantage(priority, **entry['params'])
+        price = quote_price(json_data)
+        if price is not None:
+            entry['json_data'] = json_data
+            entry['updated'] = time.time()
+            entry['ring'].append(entry['updated'], price)
+        elif entry['json_data'] is None:
+            entry['json_data'] = json_data # Nothing better to show than the notice
+
+    def _loop(self):
+        while True:
+            now = time.time()
+            interval = self.interval()
+            # Pages read a quote once per interval, it needs as long to count as unread
+            timeout = max(QUOTE_WATCH_TIMEOUT, 2 * interval)
+            with self._lock:
+                for key in [k for k, e in self._watched.items() if now - e['seen'] > timeout]:
+                    del self._watched[key]
+                due = [e for e in self._watched.values() if now - e['polled'] >= interval]
+            for entry in due:
+                if not has_spare_quota():
+                    break
+                try:
+                    self._poll(entry)
+                except Exception:
+                    pass # Keep the last quote, try again next interval
+            time.sleep(1)
+
+
+quote_poller = QuotePoller()